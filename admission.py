@@ -0,0 +1,157 @@
+import os
+import time
+import logging
+import threading
+from contextlib import contextmanager
+import tracing
+
+# starting memory reservation per JVM-running stage, in MB, until a run of it is observed
+MEMORY_BUDGETS = {
+    "checkout": 256,
+    "compile": 1024,
+    "test": 1536,
+    "coverage": 2048,
+    "scan": 2048,
+    "export": 256,
+}
+DEFAULT_BUDGET = 512
+# observed peaks are padded, a JVM rarely peaks at the same RSS twice
+BUDGET_MARGIN = 1.25
+MEMORY_HEADROOM = 0.9
+RAMP_INTERVAL = 2.0
+POLL_INTERVAL = 0.5
+
+
+def read_first(*paths):
+    for path in paths:
+        try:
+            with open(path) as f:
+                return f.read().strip()
+        except OSError:
+            continue
+    return None
+
+
+def cpu_limit():
+    # cgroup v2 cpu.max is "<quota> <period>" or "max <period>"; v1 splits them
+    value = read_first("/sys/fs/cgroup/cpu.max")
+    if value is not None:
+        quota, period = value.split()
+        if quota != "max":
+            return max(1, int(int(quota) / int(period)))
+    quota = read_first("/sys/fs/cgroup/cpu/cpu.cfs_quota_us", "/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_quota_us")
+    period = read_first("/sys/fs/cgroup/cpu/cpu.cfs_period_us", "/sys/fs/cgroup/cpu,cpuacct/cpu.cfs_period_us")
+    if quota is not None and period is not None and int(quota) > 0:
+        return max(1, int(int(quota) / int(period)))
+    return len(os.sched_getaffinity(0))
+
+
+def meminfo():
+    values = {}
+    with open("/proc/meminfo") as f:
+        for line in f:
+            key, value = line.split(":", 1)
+            values[key] = int(value.split()[0]) * 1024
+    return values
+
+
+def memory_limit():
+    value = read_first("/sys/fs/cgroup/memory.max", "/sys/fs/cgroup/memory/memory.limit_in_bytes")
+    total = meminfo()["MemTotal"]
+    if value is None or value == "max":
+        return total
+    # v1 reports an unlimited group as a huge page-aligned number
+    return min(int(value), total)
+
+
+def memory_available(limit):
+    used = read_first("/sys/fs/cgroup/memory.current", "/sys/fs/cgroup/memory/memory.usage_in_bytes")
+    available = meminfo()["MemAvailable"]
+    if used is not None:
+        available = min(available, limit - int(used))
+    return max(0, available)
+
+
+class AdmissionController:
+    """Admits JVM-running commands while CPU and memory allow it.
+
+    Every command reserves its stage's memory budget until it exits. The
+    number of commands allowed to run at once starts at the CPU limit and is
+    ramped up while the load average and free memory leave room, and down
+    when the box is oversubscribed. One command is always admitted so a run
+    can never stall.
+    """
+
+    def __init__(self, cpus=None, memory=None, budgets=None):
+        self.cpus = cpus or cpu_limit()
+        self.memory = memory or memory_limit()
+        self.budgets = {stage: mb * 1024 * 1024 for stage, mb in dict(MEMORY_BUDGETS, **(budgets or {})).items()}
+        self.observed = {}
+        self.limit = self.cpus
+        self.running = 0
+        self.reserved = 0
+        self.ramped_at = 0.0
+        self.condition = threading.Condition()
+        logging.info(f"admission: {self.cpus} cpus, {self.memory / 2**30:.1f} GiB memory")
+
+    def budget(self, stage):
+        if stage in self.observed:
+            return int(self.observed[stage] * BUDGET_MARGIN)
+        return self.budgets.get(stage, DEFAULT_BUDGET * 1024 * 1024)
+
+    def ramp(self):
+        now = time.monotonic()
+        if now - self.ramped_at < RAMP_INTERVAL:
+            return
+        self.ramped_at = now
+        load = os.getloadavg()[0]
+        free = memory_available(self.memory)
+        if load > self.cpus * 1.2 or free < self.memory * (1 - MEMORY_HEADROOM):
+            limit = max(1, min(self.limit, self.running) - 1)
+        elif load < self.cpus * 0.8 and self.running >= self.limit:
+            limit = self.limit + 1
+        else:
+            return
+        if limit != self.limit:
+            logging.debug(f"admission: {self.limit} -> {limit} concurrent commands (load {load:.1f}, {free / 2**30:.1f} GiB free)")
+            self.limit = limit
+
+    def fits(self, need):
+        if self.running == 0:
+            return True
+        if self.running >= self.limit:
+            return False
+        return self.reserved + need <= self.memory * MEMORY_HEADROOM
+
+    @contextmanager
+    def admit(self, stage):
+        need = self.budget(stage)
+        with tracing.span("admission", stage=stage), self.condition:
+            self.ramp()
+            while not self.fits(need):
+                self.condition.wait(POLL_INTERVAL)
+                self.ramp()
+            self.running += 1
+            self.reserved += need
+        try:
+            yield
+        finally:
+            with self.condition:
+                self.running -= 1
+                self.reserved -= need
+                self.condition.notify_all()
+
+    def observe(self, stage, max_rss_kb):
+        if max_rss_kb:
+            with self.condition:
+                self.observed[stage] = max(self.observed.get(stage, 0), max_rss_kb * 1024)
+
+
+def memory_budgets(value):
+    # "scan=3072,test=2048" in MB
+    budgets = {}
+    for item in value.split(","):
+        if item.strip():
+            stage, mb = item.split("=")
+            budgets[stage.strip()] = int(mb)
+    return budgets
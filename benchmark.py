@@ -0,0 +1,239 @@
+import os
+import sys
+import glob
+import json
+import math
+import time
+import shutil
+import logging
+import argparse
+import tempfile
+import subprocess
+from fake_sonarqube import FakeSonarQube
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+PROJECT = "Math"
+STAGES = ["checkout", "compile", "test", "coverage", "complexity"]
+# top-level trace spans that belong to the measured pipeline, render excluded
+PIPELINE_SPANS = {"checkout", "compile", "test", "coverage", "scan", "file_measures"}
+MEASURES = {"complexity": 42, "cognitive_complexity": 30, "ncloc": 1000, "functions": 80, "duplicated_lines_density": 1.5}
+
+# the stubs print exactly what the pipeline parses: the ant junit summary,
+# defects4j's coverage summary, failing_tests, all_tests, coverage.xml and
+# sonar-scanner's report-task.txt; BENCH_COVERED_LINES (0-3),
+# BENCH_FAILING_TESTS and BENCH_SCAN_ERROR vary what they report
+DEFECTS4J_STUB = r"""#!/bin/bash
+cmd=$1; shift
+latency() { local var=BENCH_LATENCY_${cmd^^}; sleep "${!var:-${BENCH_LATENCY:-0}}"; }
+case $cmd in
+  info)
+    echo "Summary of configuration for Project: Lang";;
+  checkout)
+    while [ $# -gt 0 ]; do case $1 in -p) p=$2; shift;; -v) v=$2; shift;; -w) w=$2; shift;; esac; shift; done
+    latency
+    mkdir -p "$w/src/main/java/org/bench" "$w/src/test/java/org/bench"
+    cat > "$w/src/main/java/org/bench/Calc.java" <<'JAVA'
+package org.bench;
+public class Calc {
+    public int sign(int a) { if (a > 0) { return 1; } else if (a < 0) { return -1; } return 0; }
+    public int sum(int[] values) { int total = 0; for (int v : values) { total += v > 0 ? v : 0; } return total; }
+}
+JAVA
+    printf "testSign(org.bench.CalcTest)\ntestSum(org.bench.CalcTest)\n" > "$w/all_tests"
+    printf "pid=%s\nvid=%s\n" "$p" "$v" > "$w/.defects4j.config"
+    echo "Checking out to $w .... OK";;
+  export)
+    while [ $# -gt 0 ]; do case $1 in -p) p=$2; shift;; -o) o=$2; shift;; esac; shift; done
+    case $p in
+      dir.src.classes) v=src/main/java;; dir.src.tests) v=src/test/java;;
+      dir.bin.classes) v=target/classes;; dir.bin.tests) v=target/test-classes;;
+    esac
+    printf "%s" "$v" > "$o";;
+  compile)
+    latency
+    mkdir -p target/classes target/test-classes
+    echo "Running ant (compile.tests)................................................ OK";;
+  test)
+    latency
+    failing=${BENCH_FAILING_TESTS:-0}
+    : > failing_tests
+    for ((i = 0; i < failing; i++)); do
+      printf -- "--- org.bench.CalcTest::testBroken%d\njunit.framework.AssertionFailedError\n" "$i" >> failing_tests
+    done
+    echo "    [junit] Running org.bench.CalcTest"
+    echo "    [junit] Tests run: $((2 + failing)), Failures: $failing, Errors: 0, Skipped: 0, Time elapsed: 0.01 sec"
+    echo "Failing tests: $failing";;
+  coverage)
+    latency
+    # the first BENCH_COVERED_LINES of Calc's three lines were hit, with their conditions
+    covered=${BENCH_COVERED_LINES:-2}
+    hits=(0 0 0); conditions=(0 0)
+    for ((i = 0; i < covered; i++)); do hits[$i]=4; done
+    [ "$covered" -gt 0 ] && conditions[0]=3
+    [ "$covered" -gt 1 ] && conditions[1]=1
+    cat > coverage.xml <<XML
+<?xml version="1.0"?>
+<coverage line-rate="0.8">
+<packages><package name="org.bench"><classes><class name="org.bench.Calc" filename="org/bench/Calc.java">
+<lines><line number="3" hits="${hits[0]}" branch="true" condition-coverage="$((conditions[0] * 100 / 4))% (${conditions[0]}/4)"/><line number="4" hits="${hits[1]}" branch="true" condition-coverage="$((conditions[1] * 100 / 2))% (${conditions[1]}/2)"/><line number="5" hits="${hits[2]}"/></lines>
+</class></classes></package></packages></coverage>
+XML
+    lines=$(awk "BEGIN { printf \"%.1f\", $covered * 100 / 3 }")
+    branches=$(awk "BEGIN { printf \"%.1f\", (${conditions[0]} + ${conditions[1]}) * 100 / 6 }")
+    printf "Lines total: 3\nLines covered: %d\nConditions total: 6\nConditions covered: %d\nLine coverage: %s%%\nCondition coverage: %s%%\n" "$covered" "$((conditions[0] + conditions[1]))" "$lines" "$branches";;
+  *)
+    echo "unknown command $cmd" >&2; exit 1;;
+esac
+"""
+
+SCANNER_STUB = r"""#!/bin/bash
+for arg in "$@"; do
+  case $arg in
+    -Dsonar.projectKey=*) key=${arg#*=};;
+    -Dsonar.host.url=*) url=${arg#*=};;
+  esac
+done
+sleep "${BENCH_LATENCY_SCAN:-${BENCH_LATENCY:-0}}"
+if [ -n "$BENCH_SCAN_ERROR" ]; then
+  echo "INFO: EXECUTION FAILURE"
+  echo "ERROR: $BENCH_SCAN_ERROR"
+  exit 1
+fi
+mkdir -p .scannerwork
+printf "projectKey=%s\nserverUrl=%s\nceTaskId=task-%s\n" "$key" "$url" "$key" > .scannerwork/report-task.txt
+echo "INFO: ANALYSIS SUCCESSFUL, you can find the results at: $url/dashboard?id=$key"
+"""
+
+
+def write_executable(path, content):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with open(path, "w") as f:
+        f.write(content)
+    os.chmod(path, 0o755)
+
+
+def install_stubs(root, versions):
+    """Lay out a fake defects4j framework and sonar-scanner under root, return their bin dirs."""
+    d4j = os.path.join(root, "defects4j", "framework", "bin")
+    scanner = os.path.join(root, "sonar-scanner", "bin")
+    write_executable(os.path.join(d4j, "defects4j"), DEFECTS4J_STUB)
+    write_executable(os.path.join(scanner, "sonar-scanner"), SCANNER_STUB)
+    # get_project_bugs lists one trigger_tests file per bug
+    triggers = os.path.join(root, "defects4j", "framework", "projects", PROJECT, "trigger_tests")
+    os.makedirs(triggers, exist_ok=True)
+    for version in range(1, versions + 1):
+        open(os.path.join(triggers, str(version)), "w").close()
+    return d4j, scanner
+
+
+def latest_trace(w):
+    traces = sorted(glob.glob(os.path.join(w, "traces", "trace-*.json")))
+    if not traces:
+        return []
+    with open(traces[-1]) as f:
+        return [event for event in json.load(f)["traceEvents"] if event["ph"] == "X"]
+
+
+def pipeline_seconds(events):
+    # from the first checkout to the last scan, whether stages overlap or not
+    events = [event for event in events if event["cat"] in PIPELINE_SPANS]
+    if not events:
+        return 0.0
+    return (max(event["ts"] + event["dur"] for event in events) - min(event["ts"] for event in events)) / 1e6
+
+
+def ideal_seconds(versions, jobs, latencies, barriers, overlap_tests=False):
+    # perfect packing of the stub latencies onto the workers; streamed, only
+    # the slowest stage is paid for every round, the others once to fill the
+    # pipeline, and every round of tests in full when tests run alone
+    rounds = math.ceil(versions / jobs)
+    stages = [latencies[stage] for stage in ("checkout", "compile", "test", "coverage", "scan")]
+    if barriers:
+        return rounds * sum(stages)
+    if overlap_tests:
+        return (rounds - 1) * max(stages) + sum(stages)
+    others = [latencies[stage] for stage in ("checkout", "compile", "coverage", "scan")]
+    return rounds * latencies["test"] + (rounds - 1) * max(others) + sum(others)
+
+
+def run_scenario(script, versions, jobs, latencies, extra, outputs=None):
+    root = tempfile.mkdtemp(prefix=f"bench-{versions}-")
+    try:
+        d4j, scanner = install_stubs(root, versions)
+        w = os.path.join(root, "w")
+        out = os.path.join(root, "out")
+        os.makedirs(out)
+        os.makedirs(w)
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)))
+        env.update({f"BENCH_LATENCY_{stage.upper()}": str(seconds) for stage, seconds in latencies.items()})
+        env.update({f"BENCH_{name.upper()}": str(value) for name, value in (outputs or {}).items() if value is not None})
+
+        with FakeSonarQube(pending_polls=0, default_measures=MEASURES) as sonar:
+            argv = [
+                sys.executable, os.path.abspath(script), "-w", w, "-d", d4j, "-s", scanner, "-p", PROJECT,
+                "-t", "bench", "-k", "bench", "--sonar-url", sonar.url, "-j", str(jobs), "--only", ",".join(STAGES),
+            ] + extra
+            start = time.monotonic()
+            result = subprocess.run(argv, cwd=out, env=env, stdout=subprocess.DEVNULL, stderr=subprocess.PIPE, text=True)
+            wall = time.monotonic() - start
+        if result.returncode != 0:
+            raise RuntimeError(f"{script} failed on {versions} versions:\n{result.stderr[-2000:]}")
+
+        pipeline = pipeline_seconds(latest_trace(w))
+        ideal = ideal_seconds(versions, jobs, latencies, "--stage-barriers" in extra, "--overlap-tests" in extra)
+        return {
+            "versions": versions,
+            "jobs": jobs,
+            "wall": wall,
+            "pipeline": pipeline,
+            "ideal": ideal,
+            "throughput": versions / pipeline * 60 if pipeline else 0.0,
+            "overhead": pipeline - ideal,
+            "overhead_per_version_ms": (pipeline - ideal) / versions * 1000,
+        }
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="hermetic throughput benchmark of the pipeline against stub defects4j, sonar-scanner and sonarqube")
+    parser.add_argument("--script", default="script.py",type=str, help="pipeline entry point to benchmark")
+    parser.add_argument("--versions", default="10,100,1000",type=str, help="comma separated synthetic version counts, one scenario each")
+    parser.add_argument("-j", "--jobs", default=8,type=int, help="workers passed to the pipeline")
+    parser.add_argument("--latency", default=0.0,type=float, help="seconds every stub command sleeps")
+    parser.add_argument("--scan-latency", default=None,type=float, help="seconds the stub sonar-scanner sleeps, defaults to --latency")
+    parser.add_argument("--covered-lines", default=None,type=int, choices=range(4), help="lines of the stub's three the coverage stub reports as hit, defaults to 2")
+    parser.add_argument("--failing-tests", default=None,type=int, help="failing tests the test stub reports on top of its two passing ones")
+    parser.add_argument("--scan-error", default=None,type=str, help="make the stub sonar-scanner fail with this ERROR line")
+    parser.add_argument("--output", default=None,type=str, help="also write the results as JSON lines to this file")
+    args, extra = parser.parse_known_args()
+
+    latencies = {stage: args.latency for stage in ("checkout", "compile", "test", "coverage")}
+    latencies["scan"] = args.latency if args.scan_latency is None else args.scan_latency
+
+    outputs = {"covered_lines": args.covered_lines, "failing_tests": args.failing_tests, "scan_error": args.scan_error}
+
+    results = []
+    for versions in [int(value) for value in args.versions.split(",")]:
+        result = run_scenario(args.script, versions, args.jobs, latencies, extra, outputs)
+        results.append(result)
+        logging.info(
+            f"{versions:5d} versions, {args.jobs} jobs: {result['throughput']:8.1f} versions/min, "
+            f"pipeline {result['pipeline']:.1f}s (ideal {result['ideal']:.1f}s), "
+            f"scheduler overhead {result['overhead']:.1f}s = {result['overhead_per_version_ms']:.1f} ms/version, "
+            f"wall {result['wall']:.1f}s"
+        )
+
+    if args.output:
+        with open(args.output, "w") as f:
+            for result in results:
+                f.write(json.dumps(result) + "\n")
+        logging.info(f"Results saved as '{args.output}'")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,91 @@
+import os
+import logging
+import threading
+import subprocess
+
+DEFECTS4J_CONFIG = ".defects4j.config"
+reference_locks = {}
+locks_lock = threading.Lock()
+
+
+def git(cwd, *args):
+    return subprocess.run(["git", "-C", cwd, *args], capture_output=True, text=True)
+
+
+def read_config(cwd):
+    config = {}
+    try:
+        with open(os.path.join(cwd, DEFECTS4J_CONFIG)) as f:
+            for line in f:
+                key, sep, value = line.strip().partition("=")
+                if sep:
+                    config[key] = value
+    except OSError:
+        pass
+    return config
+
+
+def is_valid_checkout(cwd, project, version):
+    """True when cwd already holds defects4j's checkout of this buggy version.
+
+    defects4j writes .defects4j.config before it applies the bug and tags
+    the result, so a checkout only counts once HEAD is the buggy version's
+    tag; that also catches working trees whose object store went missing.
+    """
+    config = read_config(cwd)
+    if config.get("pid") != project or config.get("vid") != version + "b":
+        return False
+    if os.path.isdir(os.path.join(cwd, ".git")):
+        head = git(cwd, "rev-parse", "-q", "--verify", "HEAD^{commit}")
+        tag = git(cwd, "rev-parse", "-q", "--verify", f"refs/tags/D4J_{project}_{version}_BUGGY_VERSION^{{commit}}")
+        return head.returncode == 0 and tag.returncode == 0 and head.stdout == tag.stdout
+    return True
+
+
+def objects_size(cwd):
+    total = 0
+    for root, dirs, files in os.walk(os.path.join(cwd, ".git", "objects")):
+        for name in files:
+            total += os.path.getsize(os.path.join(root, name))
+    return total
+
+
+def reference_lock(reference):
+    with locks_lock:
+        return reference_locks.setdefault(reference, threading.Lock())
+
+
+def share_objects(cwd, reference, version):
+    """Move a checkout's git objects into the project's bare reference repository.
+
+    Every version of a project clones the same history, so the reference
+    keeps one copy of it and each checkout points at it through
+    objects/info/alternates, keeping only objects the reference lacks.
+    Returns the bytes freed, or None when cwd is not a git checkout.
+    """
+    if not os.path.isdir(os.path.join(cwd, ".git")):
+        return None
+    before = objects_size(cwd)
+    with reference_lock(reference):
+        if not os.path.isdir(reference):
+            result = git(os.path.dirname(reference), "init", "-q", "--bare", os.path.basename(reference))
+            if result.returncode != 0:
+                logging.warning(f"could not create {reference}: {result.stderr.strip()}")
+                return None
+        # the refs keep every version's commits, tags included, alive in the reference
+        result = git(reference, "fetch", "-q", "--no-tags", os.path.abspath(cwd), f"+refs/*:refs/versions/{version}/*", f"+HEAD:refs/versions/{version}/HEAD")
+        if result.returncode != 0:
+            logging.warning(f"could not share the objects of {cwd}: {result.stderr.strip()}")
+            return None
+
+    alternates = os.path.join(cwd, ".git", "objects", "info", "alternates")
+    os.makedirs(os.path.dirname(alternates), exist_ok=True)
+    with open(alternates, "w") as f:
+        f.write(os.path.abspath(os.path.join(reference, "objects")) + "\n")
+    # -l leaves out everything the alternate already has
+    for args in (("repack", "-a", "-d", "-l", "-q"), ("prune-packed",)):
+        result = git(cwd, *args)
+        if result.returncode != 0:
+            logging.warning(f"git {args[0]} in {cwd} failed: {result.stderr.strip()}")
+            return 0
+    return before - objects_size(cwd)
@@ -0,0 +1,75 @@
+import re
+import xml.etree.ElementTree as ET
+
+CONDITIONS = re.compile(r"\((\d+)/(\d+)\)")
+
+
+def line_conditions(element):
+    if element.get("branch") != "true":
+        return 0, 0
+    match = CONDITIONS.search(element.get("condition-coverage", ""))
+    if match is None:
+        return 0, 0
+    return int(match.group(2)), int(match.group(1))
+
+
+def iter_coverage(path):
+    """Stream a Cobertura coverage.xml as ("package"|"class"|"line", ...) rows.
+
+    Elements are cleared as soon as they are read, so memory stays bounded
+    by one class rather than the whole report. Lines repeated under
+    <methods> are skipped, only the class-level <lines> are counted.
+    """
+    package = test_class = filename = None
+    package_totals = class_totals = None
+    in_methods = 0
+
+    for event, element in ET.iterparse(path, events=("start", "end")):
+        tag = element.tag
+        if event == "start":
+            if tag == "package":
+                package = element.get("name", "")
+                package_totals = [0, 0, 0, 0]
+            elif tag == "class":
+                test_class = element.get("name", "")
+                filename = element.get("filename", "")
+                class_totals = [0, 0, 0, 0]
+            elif tag == "methods":
+                in_methods += 1
+            continue
+
+        if tag == "line" and test_class is not None and not in_methods:
+            hits = int(element.get("hits", 0))
+            conditions_total, conditions_covered = line_conditions(element)
+            class_totals[0] += 1
+            class_totals[1] += 1 if hits else 0
+            class_totals[2] += conditions_total
+            class_totals[3] += conditions_covered
+            yield ("line", package, test_class, int(element.get("number", 0)), hits, conditions_total, conditions_covered)
+            element.clear()
+        elif tag == "methods":
+            in_methods -= 1
+            element.clear()
+        elif tag == "class":
+            yield ("class", package, test_class, filename, *class_totals)
+            package_totals = [total + value for total, value in zip(package_totals, class_totals)]
+            test_class = None
+            element.clear()
+        elif tag == "package":
+            yield ("package", package, *package_totals)
+            element.clear()
+
+
+def summarize_packages(packages):
+    lines_total = sum(row[1] for row in packages)
+    lines_covered = sum(row[2] for row in packages)
+    conditions_total = sum(row[3] for row in packages)
+    conditions_covered = sum(row[4] for row in packages)
+    return {
+        "lines_total": lines_total,
+        "lines_covered": lines_covered,
+        "conditions_total": conditions_total,
+        "conditions_covered": conditions_covered,
+        "line_coverage": round(100 * lines_covered / lines_total, 1) if lines_total else 0.0,
+        "condition_coverage": round(100 * conditions_covered / conditions_total, 1) if conditions_total else 0.0,
+    }
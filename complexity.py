@@ -0,0 +1,242 @@
+import os
+import re
+import hashlib
+import random
+import logging
+import argparse
+from concurrent.futures import ProcessPoolExecutor
+
+TOKEN = re.compile(r"""
+    (?P<skip>\s+|//[^\n]*|/\*.*?\*/)
+  | (?P<text>"(?:\\.|[^"\\])*"|'(?:\\.|[^'\\])*')
+  | (?P<word>[A-Za-z_$][\w$]*)
+  | (?P<op>->|::|&&|\|\||[{}()\[\];,.?:<>=!@])
+  | (?P<other>.)
+""", re.S | re.X)
+TEXT_BLOCK = re.compile(r'""".*?"""', re.S)
+
+DECISIONS = {"if", "for", "while", "case", "&&", "||", "?"}
+CLASS_KEYWORDS = {"class", "interface", "enum", "record"}
+NOT_METHODS = {"if", "for", "while", "switch", "catch", "synchronized", "return", "new", "throw", "super", "this", "try", "else", "do", "assert", "yield"}
+
+
+def engine_fingerprint():
+    # cached local measures are only reused while the analyzer itself is unchanged
+    with open(__file__, "rb") as f:
+        return "local-" + hashlib.sha1(f.read()).hexdigest()
+
+
+def tokenize(source):
+    source = TEXT_BLOCK.sub('""', source)
+    tokens = []
+    for match in TOKEN.finditer(source):
+        kind = match.lastgroup
+        if kind == "skip":
+            continue
+        tokens.append('""' if kind == "text" else match.group(kind))
+    return tokens
+
+
+def is_decision(tokens, index):
+    token = tokens[index]
+    if token not in DECISIONS:
+        return False
+    if token == "?":
+        # generic wildcards (List<?>, ? extends T) are not conditional operators
+        previous = tokens[index - 1] if index else ""
+        following = tokens[index + 1] if index + 1 < len(tokens) else ""
+        return previous not in ("<", ",") and following not in (">", "extends", "super", ",")
+    return True
+
+
+def analyze_source(source):
+    """McCabe complexity of one Java compilation unit, close to SonarQube's rules.
+
+    Every method, constructor and each if, for, while (which also covers
+    do-while), case, &&, || and ?: adds one. Lambdas, catch and default do not.
+    Returns the file total and a list of (method name, complexity).
+    """
+    tokens = tokenize(source)
+    stack = []
+    methods = []
+    total = 0
+    pending_class = False
+    candidate = None
+    header_done = False
+    paren_depth = 0
+    statement_has_assign = False
+    new_call_depth = None
+
+    for index, token in enumerate(tokens):
+        in_class = bool(stack) and stack[-1][0] == "class"
+
+        if is_decision(tokens, index):
+            total += 1
+            for kind, method in reversed(stack):
+                if kind == "method":
+                    method[1] += 1
+                    break
+            continue
+
+        if token in CLASS_KEYWORDS and (index == 0 or tokens[index - 1] != "."):
+            pending_class = True
+        elif token == "=" and in_class:
+            statement_has_assign = True
+        elif token == "new":
+            new_call_depth = paren_depth
+        elif token == "(":
+            if in_class and candidate is None and not statement_has_assign and index > 0:
+                name = tokens[index - 1]
+                before = tokens[index - 2] if index > 1 else ""
+                if re.match(r"[A-Za-z_$]", name) and name not in NOT_METHODS and before not in (".", "@", "new"):
+                    candidate = (name, paren_depth)
+            paren_depth += 1
+        elif token == ")":
+            paren_depth -= 1
+            if candidate is not None and paren_depth == candidate[1]:
+                header_done = True
+        elif token == "{":
+            if pending_class:
+                stack.append(("class", None))
+                pending_class = False
+            elif candidate is not None and header_done:
+                method = [candidate[0], 1]
+                methods.append(method)
+                total += 1
+                stack.append(("method", method))
+            elif new_call_depth is not None and new_call_depth == paren_depth and index and tokens[index - 1] == ")":
+                stack.append(("class", None))
+            else:
+                stack.append(("block", None))
+            candidate = None
+            header_done = False
+            new_call_depth = None
+            statement_has_assign = False
+        elif token == "}":
+            if stack:
+                stack.pop()
+            statement_has_assign = False
+        elif token == ";":
+            if candidate is not None and paren_depth <= candidate[1]:
+                candidate = None
+                header_done = False
+            if paren_depth == 0:
+                statement_has_assign = False
+                new_call_depth = None
+        elif header_done and token not in ("throws", ",", ".") and not re.match(r"[A-Za-z_$]", token):
+            candidate = None
+            header_done = False
+
+    return total, [(name, complexity) for name, complexity in methods]
+
+
+def analyze_file(path):
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        total, methods = analyze_source(f.read())
+    return path, total, methods
+
+
+def java_files(roots):
+    files = []
+    for root in roots:
+        for directory, dirs, names in os.walk(root):
+            dirs[:] = [d for d in dirs if not d.startswith(".")]
+            files.extend(os.path.join(directory, name) for name in names if name.endswith(".java"))
+    return sorted(files)
+
+
+def analyze_files(files, executor=None):
+    if executor is None:
+        return [analyze_file(path) for path in files]
+    return list(executor.map(analyze_file, files, chunksize=32))
+
+
+def analyze_tree(roots, executor=None):
+    results = analyze_files(java_files(roots), executor)
+    return {
+        "complexity": sum(total for path, total, methods in results),
+        "functions": sum(len(methods) for path, total, methods in results),
+        "files": len(results),
+    }
+
+
+def hash_file(path):
+    with open(path, "rb") as f:
+        return hashlib.sha1(f.read()).hexdigest()
+
+
+def analyze_incremental(store, project, version, cwd, roots, executor=None):
+    """Analyse only the files whose content the cache has not seen, then sum the version from the cache.
+
+    Consecutive bug versions share almost every file, so after the first
+    version of a project only the handful of changed files is parsed.
+    """
+    hashes = {path: hash_file(path) for path in java_files([os.path.join(cwd, root) for root in roots])}
+    known = store.file_complexities(set(hashes.values()), "complexity-engine")
+    missing = {}
+    for path, digest in hashes.items():
+        if digest not in known:
+            missing.setdefault(digest, path)
+
+    fresh = [(hashes[path], total, len(methods)) for path, total, methods in analyze_files(list(missing.values()), executor)]
+    store.record_file_complexities("complexity-engine", fresh)
+    known.update({digest: (total, functions) for digest, total, functions in fresh})
+
+    store.record_version_files(project, version, "local", [
+        (os.path.relpath(path, cwd), digest, known[digest][0]) for path, digest in hashes.items()
+    ])
+    return {
+        "complexity": sum(known[digest][0] for digest in hashes.values()),
+        "functions": sum(known[digest][1] for digest in hashes.values()),
+        "files": len(hashes),
+        "analysed": len(fresh),
+    }
+
+
+def calibrate(store, projects, w, sample, workers):
+    # compare against versions that were already analysed by SonarQube
+    pairs = []
+    for project in projects:
+        # analyse the same directories the scanner was given
+        layouts = store.load(project, "layout")
+        for version, measures in store.load(project, "sonar_measures").items():
+            cwd = w+"/"+project+"/345/"+version
+            roots = layouts.get(version, {}).get("sources") or ["."]
+            if "complexity" in measures and os.path.isdir(cwd):
+                pairs.append((project, version, float(measures["complexity"]), [os.path.join(cwd, root) for root in roots]))
+    pairs = random.sample(pairs, min(sample, len(pairs)))
+    if not pairs:
+        logging.error("no checked out versions with a SonarQube complexity to compare against")
+        return []
+
+    rows = []
+    with ProcessPoolExecutor(max_workers=max(1, workers)) as executor:
+        for project, version, sonar, roots in sorted(pairs):
+            local = analyze_tree(roots, executor)["complexity"]
+            rows.append((project, version, sonar, local, (local - sonar) / sonar * 100 if sonar else 0.0))
+            logging.info(f"{project} {version}: sonarqube {sonar:.0f}, local {local}, {rows[-1][4]:+.1f}%")
+
+    errors = [abs(row[4]) for row in rows]
+    ratio = sum(row[3] for row in rows) / sum(row[2] for row in rows) if any(row[2] for row in rows) else 0.0
+    logging.info(f"{len(rows)} versions: mean |error| {sum(errors) / len(errors):.1f}%, max |error| {max(errors):.1f}%, local/sonarqube ratio {ratio:.3f}")
+    return rows
+
+
+def main():
+    from results import ResultStore
+
+    logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+    parser = argparse.ArgumentParser(description="compare the local complexity engine against stored SonarQube measures")
+    parser.add_argument("-w", required=True,type=str, help="directory with the defects4j checkouts")
+    parser.add_argument("-p", required=True,type=str, help="comma separated defects4j projects")
+    parser.add_argument("--sample", default=10,type=int, help="number of versions to compare")
+    parser.add_argument("--cache", default=None,type=str, help="results database, defaults to <w>/results.db")
+    parser.add_argument("-j", "--jobs", default=os.cpu_count(),type=int, help="processes analysing files")
+    args = parser.parse_args()
+
+    store = ResultStore(args.cache or args.w+"/results.db", {})
+    calibrate(store, args.p.split(","), args.w, args.sample, args.jobs)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,160 @@
+import os
+import csv
+import numpy as np
+
+METRIC_COLUMNS = [
+    "line_coverage",
+    "condition_coverage",
+    "complexity",
+    "local_complexity",
+    "cognitive_complexity",
+    "ncloc",
+    "functions",
+    "duplicated_lines_density",
+    "test_seconds",
+    "test_seconds_ci_low",
+    "test_seconds_ci_high",
+    "test_cpu_seconds",
+    "test_max_rss_kb",
+]
+COLUMNS = ["project", "version", "failed", "timed_out"] + METRIC_COLUMNS
+CORRELATED = ["complexity", "test_seconds", "line_coverage", "condition_coverage"]
+
+
+def version_rows(store, project):
+    coverages = store.load(project, "coverage")
+    measures = store.load(project, "sonar_measures")
+    local = store.load(project, "local_measures")
+    delays = store.load(project, "test_time")
+    benchmarks = store.load(project, "test_benchmark")
+
+    for version in sorted(set(coverages) | set(measures) | set(local) | set(delays), key=int):
+        coverage = coverages.get(version, {})
+        measure = measures.get(version, {})
+        benchmark = benchmarks.get(version, {})
+        wall = benchmark.get("wall_time", {})
+        yield project, int(version), (
+            coverage.get("line_coverage"),
+            coverage.get("condition_coverage"),
+            measure.get("complexity"),
+            local.get(version, {}).get("complexity"),
+            measure.get("cognitive_complexity"),
+            measure.get("ncloc"),
+            measure.get("functions"),
+            measure.get("duplicated_lines_density"),
+            delays.get(version),
+            wall.get("ci_low"),
+            wall.get("ci_high"),
+            benchmark.get("cpu_time", {}).get("median"),
+            benchmark.get("max_rss_kb"),
+        )
+
+
+def build_dataset(store, projects, failures, timeouts=()):
+    """One row per project/version with a typed NumPy column per metric."""
+    projects_column, versions_column, metric_rows = [], [], []
+    for project in projects:
+        for project, version, metrics in version_rows(store, project):
+            projects_column.append(project)
+            versions_column.append(version)
+            metric_rows.append(metrics)
+
+    # None becomes NaN, so a missing metric never needs a Python-level check
+    metrics = np.array(metric_rows, dtype=float).reshape(len(metric_rows), len(METRIC_COLUMNS))
+    dataset = {
+        "project": np.array(projects_column, dtype=str),
+        "version": np.array(versions_column, dtype=np.int64),
+    }
+    failed = {f"{project}:{version}" for project, version in failures}
+    keys = np.char.add(np.char.add(dataset["project"], ":"), dataset["version"].astype(str))
+    dataset["failed"] = np.isin(keys, list(failed)) if failed else np.zeros(len(keys), dtype=bool)
+    # kept apart from failed: a killed command says nothing about the version's code
+    timed_out = {f"{project}:{version}" for project, version in timeouts}
+    dataset["timed_out"] = np.isin(keys, list(timed_out)) if timed_out else np.zeros(len(keys), dtype=bool)
+    for index, column in enumerate(METRIC_COLUMNS):
+        dataset[column] = metrics[:, index]
+    # the local engine stands in for versions SonarQube never measured
+    dataset["complexity"] = np.where(np.isnan(dataset["complexity"]), dataset["local_complexity"], dataset["complexity"])
+    return dataset
+
+
+def select(dataset, mask):
+    return {column: values[mask] for column, values in dataset.items()}
+
+
+def drop_failed(dataset):
+    return select(dataset, ~(dataset["failed"] | dataset["timed_out"]))
+
+
+def project_rows(dataset, project):
+    return select(dataset, dataset["project"] == project)
+
+
+def as_dict(dataset, column):
+    # graph input: {version: value} for the rows where the metric was measured
+    values = dataset[column]
+    mask = np.isfinite(values)
+    return dict(zip(dataset["version"][mask].astype(str).tolist(), values[mask].tolist()))
+
+
+def average_ranks(column):
+    # 1-based ranks, tied values share the mean of the ranks they span
+    order = np.argsort(column, kind="stable")
+    sorted_values = column[order]
+    starts = np.concatenate(([True], sorted_values[1:] != sorted_values[:-1]))
+    group = np.cumsum(starts) - 1
+    bounds = np.append(np.flatnonzero(starts), len(column))
+    ranks = np.empty(len(column))
+    ranks[order] = (bounds[group] + bounds[group + 1] + 1) / 2
+    return ranks
+
+
+def ranks(matrix):
+    return np.column_stack([average_ranks(column) for column in matrix.T])
+
+
+def correlations(dataset, columns=CORRELATED):
+    """Pearson and Spearman correlation matrices over rows where every column was measured."""
+    matrix = np.column_stack([dataset[column] for column in columns])
+    matrix = matrix[np.isfinite(matrix).all(axis=1)]
+    if len(matrix) < 3:
+        return None
+    with np.errstate(invalid="ignore", divide="ignore"):
+        return {
+            "rows": len(matrix),
+            "pearson": np.corrcoef(matrix, rowvar=False),
+            "spearman": np.corrcoef(ranks(matrix), rowvar=False),
+        }
+
+
+def save_dataset(dataset, path):
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(COLUMNS)
+        writer.writerows(zip(*(dataset[column].tolist() for column in COLUMNS)))
+
+
+def load_dataset(path):
+    table = np.genfromtxt(path, delimiter=",", names=True, dtype=None, encoding="utf-8", ndmin=1)
+    dataset = {
+        "project": table["project"].astype(str),
+        "version": table["version"].astype(np.int64),
+        "failed": table["failed"].astype(str) == "True",
+    }
+    # datasets saved before timeouts were tracked have no timed_out column
+    if "timed_out" in table.dtype.names:
+        dataset["timed_out"] = table["timed_out"].astype(str) == "True"
+    else:
+        dataset["timed_out"] = np.zeros(len(table), dtype=bool)
+    for column in METRIC_COLUMNS:
+        dataset[column] = table[column].astype(float)
+    return dataset
+
+
+def save_correlations(result, path, columns=CORRELATED):
+    with open(path, "w", newline="") as f:
+        writer = csv.writer(f)
+        for method in ("pearson", "spearman"):
+            writer.writerow([method] + columns)
+            writer.writerows([column] + row.tolist() for column, row in zip(columns, result[method]))
@@ -0,0 +1,127 @@
+import os
+import sys
+import time
+import shutil
+import socket
+import logging
+import argparse
+import sqlite3
+import tempfile
+import subprocess
+from fake_sonarqube import FakeSonarQube
+from benchmark import PROJECT, MEASURES, install_stubs
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+
+def leased_by(queue, worker):
+    # the queue only exists once the coordinator or a worker has opened it
+    if not os.path.exists(queue):
+        return 0
+    db = sqlite3.connect(queue, timeout=60)
+    try:
+        return db.execute("SELECT COUNT(*) FROM jobs WHERE state='leased' AND worker=?", (worker,)).fetchone()[0]
+    except sqlite3.OperationalError:
+        return 0
+    finally:
+        db.close()
+
+
+def job_states(queue):
+    db = sqlite3.connect(queue, timeout=60)
+    try:
+        counts = dict(db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        reassigned = db.execute("SELECT COUNT(*) FROM jobs WHERE attempts > 1").fetchone()[0]
+    finally:
+        db.close()
+    return counts, reassigned
+
+
+def log_tail(path, lines=20):
+    with open(path) as f:
+        return "".join(f.readlines()[-lines:])
+
+
+def run_failover(script, versions, workers, jobs, latency, lease, timeout):
+    """Run a coordinator and workers on this host, kill one worker while it holds a lease, return the job states."""
+    root = tempfile.mkdtemp(prefix=f"failover-{versions}-")
+    try:
+        d4j, scanner = install_stubs(root, versions)
+        w = os.path.join(root, "w")
+        out = os.path.join(root, "out")
+        os.makedirs(out)
+        os.makedirs(w)
+        queue = os.path.join(w, "jobs.db")
+        env = dict(os.environ, PYTHONPATH=os.path.dirname(os.path.abspath(__file__)), BENCH_LATENCY=str(latency))
+
+        with FakeSonarQube(pending_polls=0, default_measures=MEASURES) as sonar:
+            argv = [
+                sys.executable, os.path.abspath(script), "-w", w, "-d", d4j, "-s", scanner, "-p", PROJECT,
+                "-t", "bench", "-k", "bench", "--sonar-url", sonar.url, "-j", str(jobs), "--lease", str(lease),
+            ]
+            start = time.monotonic()
+            coordinator = subprocess.Popen(argv + ["--role", "coordinator"], cwd=out, env=env, stdout=subprocess.DEVNULL, stderr=open(os.path.join(root, "coordinator.log"), "w"))
+            pool = [
+                subprocess.Popen(argv + ["--role", "worker"], cwd=out, env=env, stdout=subprocess.DEVNULL, stderr=open(os.path.join(root, f"worker{i}.log"), "w"))
+                for i in range(workers)
+            ]
+            try:
+                # the victim must die holding a lease, or nothing is left to reassign
+                victim = f"{socket.gethostname()}:{pool[0].pid}"
+                while not leased_by(queue, victim):
+                    if pool[0].poll() is not None or time.monotonic() - start > timeout:
+                        raise RuntimeError(f"worker 0 never leased a job:\n{log_tail(os.path.join(root, 'worker0.log'))}")
+                    time.sleep(0.05)
+                held = leased_by(queue, victim)
+                pool[0].kill()
+                logging.info(f"killed worker {victim} holding {held} leases after {time.monotonic() - start:.1f}s")
+
+                coordinator.wait(timeout=max(1, timeout - (time.monotonic() - start)))
+                for process in pool[1:]:
+                    process.wait(timeout=max(1, timeout - (time.monotonic() - start)))
+            finally:
+                for process in [coordinator] + pool:
+                    if process.poll() is None:
+                        process.kill()
+            wall = time.monotonic() - start
+
+        if coordinator.returncode != 0:
+            raise RuntimeError(f"coordinator failed:\n{log_tail(os.path.join(root, 'coordinator.log'))}")
+        for i, process in enumerate(pool[1:], 1):
+            if process.returncode != 0:
+                raise RuntimeError(f"worker {i} failed:\n{log_tail(os.path.join(root, f'worker{i}.log'))}")
+        counts, reassigned = job_states(queue)
+        return {"versions": versions, "workers": workers, "held": held, "reassigned": reassigned, "jobs": counts, "wall": wall}
+    finally:
+        shutil.rmtree(root, ignore_errors=True)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="kill one of several workers sharing a job queue and check its leased jobs are handed to the others")
+    parser.add_argument("--script", default="script.py",type=str, help="pipeline entry point to run as coordinator and workers")
+    parser.add_argument("--versions", default=12,type=int, help="synthetic versions to publish")
+    parser.add_argument("--workers", default=3,type=int, help="worker processes to start, the first one is killed")
+    parser.add_argument("-j", "--jobs", default=2,type=int, help="threads per worker")
+    parser.add_argument("--latency", default=0.5,type=float, help="seconds every stub command sleeps")
+    parser.add_argument("--lease", default=3,type=float, help="lease seconds passed to the pipeline, a killed worker's jobs wait this long")
+    parser.add_argument("--timeout", default=600,type=float, help="seconds before the check gives up on the coordinator")
+    args = parser.parse_args()
+    if args.workers < 2:
+        parser.error("--workers must be at least 2, one of them is killed")
+
+    result = run_failover(args.script, args.versions, args.workers, args.jobs, args.latency, args.lease, args.timeout)
+    logging.info(
+        f"{result['versions']} versions, {result['workers']} workers: jobs {result['jobs']}, "
+        f"{result['reassigned']} reassigned after the kill ({result['held']} held), wall {result['wall']:.1f}s"
+    )
+    if set(result["jobs"]) != {"done"}:
+        raise SystemExit(f"jobs left unfinished after the failover: {result['jobs']}")
+    if result["reassigned"] < result["held"]:
+        raise SystemExit(f"only {result['reassigned']} of the {result['held']} jobs the killed worker held were reassigned")
+
+
+if __name__ == "__main__":
+    main()
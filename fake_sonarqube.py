@@ -0,0 +1,220 @@
+import time
+import argparse
+import json
+import logging
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import urlparse, parse_qs
+
+logging.basicConfig(
+    level=logging.INFO,
+    format="%(asctime)s - %(levelname)s - %(message)s",
+)
+
+
+class FakeSonarQube:
+    """Stand-in for the parts of the SonarQube web API the pipeline calls."""
+
+    def __init__(self, host="127.0.0.1", port=0, pending_polls=2, default_measures=None):
+        self.pending_polls = pending_polls
+        # answered for any component without measures of its own, e.g. synthetic benchmark versions
+        self.default_measures = default_measures
+        self.tasks = {}
+        self.measures = {}
+        self.file_measures = {}
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer((host, port), self.handler())
+        self.thread = None
+
+    @property
+    def url(self):
+        host, port = self.server.server_address[:2]
+        return f"http://{host}:{port}"
+
+    def add_task(self, task_id, status="SUCCESS", pending_polls=None):
+        with self.lock:
+            self.tasks[task_id] = {
+                "status": status,
+                "polls_left": self.pending_polls if pending_polls is None else pending_polls,
+                "polls": 0,
+            }
+
+    def set_measures(self, component, measures):
+        with self.lock:
+            self.measures[component] = dict(measures)
+
+    def set_file_measures(self, component, files):
+        with self.lock:
+            self.file_measures[component] = {path: dict(measures) for path, measures in files.items()}
+
+    def poll_task(self, task_id):
+        with self.lock:
+            if task_id not in self.tasks:
+                # tasks from a real or stub scanner are not registered up front
+                self.tasks[task_id] = {"status": "SUCCESS", "polls_left": self.pending_polls, "polls": 0}
+            task = self.tasks[task_id]
+            task["polls"] += 1
+            if task["polls_left"] > 0:
+                task["polls_left"] -= 1
+                return "IN_PROGRESS"
+            return task["status"]
+
+    def component_measures(self, component, metric_keys):
+        with self.lock:
+            if component not in self.measures and self.default_measures is None:
+                return None
+            values = self.measures.get(component, self.default_measures)
+            return [{"metric": metric, "value": str(values[metric])} for metric in metric_keys if metric in values]
+
+    def component_tree(self, component, metric_keys):
+        with self.lock:
+            if component not in self.measures and component not in self.file_measures and self.default_measures is None:
+                return None
+            files = self.file_measures.get(component, {})
+            return [
+                {
+                    "key": f"{component}:{path}",
+                    "path": path,
+                    "qualifier": "FIL",
+                    "measures": [{"metric": metric, "value": str(values[metric])} for metric in metric_keys if metric in values],
+                }
+                for path, values in sorted(files.items())
+            ]
+
+    def handler(self):
+        sonar = self
+
+        class Handler(BaseHTTPRequestHandler):
+            def do_GET(self):
+                parsed = urlparse(self.path)
+                query = {key: values[0] for key, values in parse_qs(parsed.query).items()}
+
+                if parsed.path == "/api/ce/task":
+                    task_id = query.get("id")
+                    if task_id is None:
+                        return self.reply(400, {"errors": [{"msg": "The 'id' parameter is missing"}]})
+                    status = sonar.poll_task(task_id)
+                    return self.reply(200, {"task": {"id": task_id, "status": status, "executionTimeMs": 0}})
+
+                if parsed.path == "/api/measures/component":
+                    component = query.get("component")
+                    metric_keys = query.get("metricKeys", "").split(",")
+                    measures = sonar.component_measures(component, metric_keys)
+                    if measures is None:
+                        return self.reply(404, {"errors": [{"msg": f"Component key '{component}' not found"}]})
+                    return self.reply(200, {"component": {"key": component, "measures": measures}})
+
+                if parsed.path == "/api/measures/search":
+                    keys = query.get("projectKeys", "").split(",")
+                    metric_keys = query.get("metricKeys", "").split(",")
+                    if len(keys) > 100:
+                        return self.reply(400, {"errors": [{"msg": "'projectKeys' can contains only 100 values"}]})
+                    measures = []
+                    for key in keys:
+                        for measure in sonar.component_measures(key, metric_keys) or []:
+                            measures.append(dict(measure, component=key))
+                    return self.reply(200, {"measures": measures})
+
+                if parsed.path == "/api/measures/component_tree":
+                    component = query.get("component")
+                    metric_keys = query.get("metricKeys", "").split(",")
+                    page, size = int(query.get("p", 1)), int(query.get("ps", 100))
+                    if size > 500:
+                        return self.reply(400, {"errors": [{"msg": f"'ps' value ({size}) must be less than 500"}]})
+                    files = sonar.component_tree(component, metric_keys)
+                    if files is None:
+                        return self.reply(404, {"errors": [{"msg": f"Component key '{component}' not found"}]})
+                    return self.reply(200, {
+                        "paging": {"pageIndex": page, "pageSize": size, "total": len(files)},
+                        "baseComponent": {"key": component},
+                        "components": files[(page - 1) * size:page * size],
+                    })
+
+                self.reply(404, {"errors": [{"msg": f"Unknown url : {parsed.path}"}]})
+
+            def reply(self, code, body):
+                data = json.dumps(body).encode()
+                self.send_response(code)
+                self.send_header("Content-Type", "application/json")
+                self.send_header("Content-Length", str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                logging.debug(format % args)
+
+        return Handler
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, daemon=True)
+        self.thread.start()
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def __enter__(self):
+        return self.start()
+
+    def __exit__(self, *exc):
+        self.stop()
+
+
+def check_ce_wait():
+    """Drive SonarQubeClient.wait_for_task through IN_PROGRESS, backoff, FAILED and timeout against the fake."""
+    from sonarqube import SonarQubeClient, CeTaskError
+
+    with FakeSonarQube() as sonar:
+        client = SonarQubeClient("offline", url=sonar.url, retries=0)
+        sonar.add_task("pending", pending_polls=3)
+        sonar.add_task("failed", status="FAILED", pending_polls=1)
+        sonar.add_task("stuck", pending_polls=1000)
+
+        start = time.monotonic()
+        task = client.wait_for_task("pending", initial_delay=0.05, max_delay=0.1)
+        elapsed = time.monotonic() - start
+        assert task["status"] == "SUCCESS", task
+        assert sonar.tasks["pending"]["polls"] == 4, sonar.tasks["pending"]
+        # 0.05s, then capped at 0.1s twice
+        assert elapsed >= 0.25, f"no backoff between polls, {elapsed:.2f}s"
+
+        try:
+            client.wait_for_task("failed", initial_delay=0.01)
+        except CeTaskError as e:
+            assert "FAILED" in str(e), e
+        else:
+            raise AssertionError("a FAILED ce task did not raise CeTaskError")
+        assert sonar.tasks["failed"]["polls"] == 2, sonar.tasks["failed"]
+
+        try:
+            client.wait_for_task("stuck", timeout=0.2, initial_delay=0.05, max_delay=0.05)
+        except CeTaskError as e:
+            assert "IN_PROGRESS" in str(e), e
+        else:
+            raise AssertionError("a ce task past its timeout did not raise CeTaskError")
+        client.close()
+    logging.info("ce task wait: IN_PROGRESS with backoff, FAILED and timeout behave")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="offline stand-in for the SonarQube web API")
+    parser.add_argument("--port", default=9000, type=int, help="port to listen on")
+    parser.add_argument("--pending-polls", default=2, type=int, help="polls a ce task stays IN_PROGRESS before SUCCESS")
+    parser.add_argument("--check", action="store_true", help="run the client's ce task wait against a fake on a free port and exit")
+    args = parser.parse_args()
+
+    if args.check:
+        check_ce_wait()
+        return
+
+    sonar = FakeSonarQube(port=args.port, pending_polls=args.pending_polls)
+    logging.info(f"fake sonarqube listening on {sonar.url}")
+    try:
+        sonar.server.serve_forever()
+    except KeyboardInterrupt:
+        sonar.server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,185 @@
+import os
+import json
+import time
+import socket
+import logging
+import sqlite3
+import threading
+import tracing
+from workers import StageGate
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    after TEXT NOT NULL,
+    state TEXT NOT NULL,
+    worker TEXT,
+    lease_until REAL,
+    attempts INTEGER NOT NULL,
+    result TEXT,
+    updated_at REAL NOT NULL,
+    PRIMARY KEY (project, version, stage)
+);
+CREATE INDEX IF NOT EXISTS jobs_state ON jobs (state)
+"""
+# a job is ready once every stage in its "after" list is done for the same version
+READY = """
+    SELECT project, version, stage FROM jobs AS job WHERE state='pending' AND stage IN ({stages}) AND NOT EXISTS (
+        SELECT 1 FROM jobs AS dep WHERE dep.project=job.project AND dep.version=job.version
+        AND dep.state != 'done' AND instr(job.after, '"' || dep.stage || '"') > 0
+    ) ORDER BY rowid LIMIT 1
+"""
+BLOCKED = """
+    UPDATE jobs SET state='failed', result='"skipped"', updated_at=? WHERE state='pending' AND EXISTS (
+        SELECT 1 FROM jobs AS dep WHERE dep.project=jobs.project AND dep.version=jobs.version
+        AND dep.state='failed' AND instr(jobs.after, '"' || dep.stage || '"') > 0
+    )
+"""
+
+
+def worker_name():
+    return f"{socket.gethostname()}:{os.getpid()}"
+
+
+class JobQueue:
+    """(project, version, stage) jobs in a SQLite file every coordinator and worker can open.
+
+    Workers lease one job at a time; a lease that is not renewed before it
+    runs out hands the job to the next worker, up to max_attempts times.
+    Keep the file on storage shared by all hosts, next to the workspace.
+    """
+
+    def __init__(self, path, lease=600, max_attempts=3):
+        self.lease_seconds = lease
+        self.max_attempts = max_attempts
+        self.lock = threading.Lock()
+        # autocommit, every change below runs in its own BEGIN IMMEDIATE
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False, isolation_level=None)
+        self.db.executescript(SCHEMA)
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def transaction(self, func, *args):
+        with self.lock:
+            self.db.execute("BEGIN IMMEDIATE")
+            try:
+                value = func(*args)
+            except BaseException:
+                self.db.execute("ROLLBACK")
+                raise
+            self.db.execute("COMMIT")
+            return value
+
+    def publish(self, jobs):
+        """Add (project, version, stage, after) jobs; done and leased ones keep their state, failed and skipped ones are retried."""
+        now = time.time()
+        rows = [(project, version, stage, json.dumps(after), "pending", None, None, 0, None, now) for project, version, stage, after in jobs]
+        def insert():
+            self.db.executemany(
+                "UPDATE jobs SET state='pending', worker=NULL, lease_until=NULL, attempts=0, result=NULL, updated_at=? WHERE project=? AND version=? AND stage=? AND state='failed'",
+                [(now, project, version, stage) for project, version, stage, after in jobs],
+            )
+            self.db.executemany("INSERT OR IGNORE INTO jobs VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?)", rows)
+        self.transaction(insert)
+
+    def settle(self):
+        # expired leases go back to pending, or fail once out of attempts, and
+        # jobs behind a failed stage can never run
+        now = time.time()
+        self.db.execute("UPDATE jobs SET state='failed', result='\"lease expired\"', updated_at=? WHERE state='leased' AND lease_until < ? AND attempts >= ?", (now, now, self.max_attempts))
+        self.db.execute("UPDATE jobs SET state='pending', worker=NULL, updated_at=? WHERE state='leased' AND lease_until < ?", (now, now))
+        while self.db.execute(BLOCKED, (now,)).rowcount:
+            pass
+
+    def lease(self, worker, stages):
+        def take():
+            self.settle()
+            row = self.db.execute(READY.format(stages=",".join("?" * len(stages))), list(stages)).fetchone()
+            if row is None:
+                return None
+            now = time.time()
+            self.db.execute(
+                "UPDATE jobs SET state='leased', worker=?, lease_until=?, attempts=attempts+1, updated_at=? WHERE project=? AND version=? AND stage=?",
+                (worker, now + self.lease_seconds, now, *row),
+            )
+            return row
+        return self.transaction(take)
+
+    def heartbeat(self, worker):
+        now = time.time()
+        self.transaction(lambda: self.db.execute("UPDATE jobs SET lease_until=? WHERE worker=? AND state='leased'", (now + self.lease_seconds, worker)))
+
+    def complete(self, project, version, stage, worker, result):
+        # a worker whose lease already moved on must not overwrite the new owner
+        state = "failed" if result is None or result is False else "done"
+        self.transaction(lambda: self.db.execute(
+            "UPDATE jobs SET state=?, result=?, updated_at=? WHERE project=? AND version=? AND stage=? AND worker=? AND state='leased'",
+            (state, json.dumps(result, default=str), time.time(), project, version, stage, worker),
+        ))
+
+    def counts(self):
+        def count():
+            self.settle()
+            return dict(self.db.execute("SELECT state, COUNT(*) FROM jobs GROUP BY state").fetchall())
+        return self.transaction(count)
+
+    def failed(self):
+        with self.lock:
+            return self.db.execute("SELECT DISTINCT project, version FROM jobs WHERE state='failed'").fetchall()
+
+
+def run_worker(jobs, functions, worker=None, threads=1, poll=2.0, exclusive=()):
+    """Lease and run jobs for the stages in functions until the queue has nothing left to hand out.
+
+    On this host, stages named in exclusive only run while no other stage does.
+    """
+    worker = worker or worker_name()
+    stopped = threading.Event()
+    gate = StageGate(exclusive)
+
+    def heartbeat():
+        while not stopped.wait(jobs.lease_seconds / 3):
+            jobs.heartbeat(worker)
+
+    def work():
+        while True:
+            job = jobs.lease(worker, list(functions))
+            if job is None:
+                # an empty queue means the coordinator has not published yet
+                counts = jobs.counts()
+                if counts and counts.get("pending", 0) + counts.get("leased", 0) == 0:
+                    return
+                time.sleep(poll)
+                continue
+            project, version, stage = job
+            try:
+                with gate.enter(stage), tracing.span(stage, project, version):
+                    result = functions[stage]((project, version))
+            except Exception as e:
+                logging.error(f"{stage} of {project} {version} failed: {e}")
+                result = None
+            jobs.complete(project, version, stage, worker, result)
+
+    logging.info(f"worker {worker} serving {', '.join(functions)}")
+    beat = threading.Thread(target=heartbeat, daemon=True)
+    beat.start()
+    pool = [threading.Thread(target=work) for thread in range(max(1, threads))]
+    for thread in pool:
+        thread.start()
+    for thread in pool:
+        thread.join()
+    stopped.set()
+
+
+def wait_for_jobs(jobs, poll=10.0):
+    # the coordinator only watches; workers do the leasing and reclaiming
+    while True:
+        counts = jobs.counts()
+        logging.info(f"jobs: {counts}")
+        if counts.get("pending", 0) + counts.get("leased", 0) == 0:
+            return counts
+        time.sleep(poll)
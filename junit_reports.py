@@ -0,0 +1,95 @@
+import os
+import re
+import xml.etree.ElementTree as ET
+
+REPORT_DIRS = ["target/surefire-reports", "target/test-reports", "build/test-reports", "build/reports", "reports"]
+ANT_RUNNING = re.compile(r"\[junit\] Running (\S+)")
+ANT_SUMMARY = re.compile(r"\[junit\] Tests run: (\d+), Failures: (\d+), Errors: (\d+).*?Time elapsed: ([\d.]+) sec")
+
+
+def find_junit_reports(cwd):
+    reports = []
+    for report_dir in REPORT_DIRS:
+        directory = os.path.join(cwd, report_dir)
+        if not os.path.isdir(directory):
+            continue
+        for root, dirs, files in os.walk(directory):
+            reports.extend(os.path.join(root, name) for name in files if name.startswith("TEST-") and name.endswith(".xml"))
+    return sorted(reports)
+
+
+def parse_junit_xml(path):
+    # iterparse keeps only one testcase element alive at a time
+    for event, element in ET.iterparse(path, events=("end",)):
+        if element.tag != "testcase":
+            continue
+        outcome = "passed"
+        for child in element:
+            if child.tag in ("failure", "error"):
+                outcome = "failed"
+            elif child.tag == "skipped":
+                outcome = "skipped"
+        yield {
+            "class": element.get("classname", ""),
+            "method": element.get("name", ""),
+            "time": float(element.get("time") or 0),
+            "outcome": outcome,
+        }
+        element.clear()
+
+
+def parse_ant_summary(log_path):
+    rows = []
+    current = None
+    with open(log_path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            running = ANT_RUNNING.search(line)
+            if running:
+                current = running.group(1)
+                continue
+            summary = ANT_SUMMARY.search(line)
+            if summary and current is not None:
+                failed = int(summary.group(2)) + int(summary.group(3))
+                rows.append({
+                    "class": current,
+                    "method": "",
+                    "time": float(summary.group(4)),
+                    "outcome": "failed" if failed else "passed",
+                })
+                current = None
+    return rows
+
+
+def parse_failing_tests(path):
+    failing = set()
+    if not os.path.isfile(path):
+        return failing
+    with open(path, "r", encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("--- "):
+                test_class, _, method = line[4:].strip().partition("::")
+                failing.add((test_class, method))
+    return failing
+
+
+def collect_test_cases(cwd, log_path):
+    """Per-class/per-method durations and outcomes of the last `defects4j test` run.
+
+    JUnit XML reports give per-method timings. Without them the ant console
+    summaries in the test log give per-class timings. defects4j's own test
+    runner writes neither, so its runs only yield the failing methods from
+    failing_tests, without times.
+    """
+    rows = []
+    for report in find_junit_reports(cwd):
+        rows.extend(parse_junit_xml(report))
+    if not rows and os.path.isfile(log_path):
+        rows = parse_ant_summary(log_path)
+
+    known = {(row["class"], row["method"]): row for row in rows}
+    for test_class, method in parse_failing_tests(os.path.join(cwd, "failing_tests")):
+        if (test_class, method) in known:
+            known[(test_class, method)]["outcome"] = "failed"
+        else:
+            rows.append({"class": test_class, "method": method, "time": None, "outcome": "failed"})
+    return rows
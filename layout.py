@@ -0,0 +1,68 @@
+import os
+import tempfile
+
+BUILD_FILES = [
+    ("maven", "pom.xml"),
+    ("gradle", "build.gradle"),
+    ("gradle", "build.gradle.kts"),
+    ("ant", "build.xml"),
+]
+# defects4j export property and the conventional directories tried when it is unavailable
+ROOTS = {
+    "sources": ("dir.src.classes", ["src/main/java", "src/java", "source", "src"]),
+    "tests": ("dir.src.tests", ["src/test/java", "src/test", "test", "tests"]),
+    "binaries": ("dir.bin.classes", ["target/classes", "build/classes", "build"]),
+    "test_binaries": ("dir.bin.tests", ["target/test-classes", "build/test-classes", "build-tests", "target/tests"]),
+}
+
+
+def build_system(cwd):
+    for name, build_file in BUILD_FILES:
+        if os.path.isfile(os.path.join(cwd, build_file)):
+            return name
+    return "unknown"
+
+
+def export_property(run, cwd, prop):
+    """Value of a defects4j export property, written through a file so build output never mixes in."""
+    fd, output = tempfile.mkstemp(prefix="export-", suffix=".txt")
+    os.close(fd)
+    try:
+        result = run(["export", "-p", prop, "-o", output], cwd)
+        if not result.ok:
+            return None
+        with open(output) as f:
+            value = f.read().strip()
+        return value or None
+    finally:
+        os.remove(output)
+
+
+def detect_layout(cwd, run=None):
+    """Build system and the source, test and class directories of one checkout, relative to it.
+
+    Directories come from defects4j export when a runner is given, otherwise
+    from the first conventional directory that exists.
+    """
+    layout = {"build": build_system(cwd)}
+    for root, (prop, candidates) in ROOTS.items():
+        value = export_property(run, cwd, prop) if run is not None else None
+        if value is not None:
+            layout[root] = [os.path.relpath(os.path.join(cwd, value), cwd)]
+        else:
+            layout[root] = [candidate for candidate in candidates if os.path.isdir(os.path.join(cwd, candidate))][:1]
+    return layout
+
+
+def scanner_properties(layout, cwd):
+    # only directories that exist, the scanner refuses missing ones
+    properties = {}
+    for root, prop in (("sources", "sonar.sources"), ("tests", "sonar.tests"), ("binaries", "sonar.java.binaries"), ("test_binaries", "sonar.java.test.binaries")):
+        present = [path for path in layout.get(root, []) if os.path.exists(os.path.join(cwd, path))]
+        if present:
+            properties[prop] = ",".join(present)
+    # a test root nested in a source root would otherwise be indexed twice
+    nested = [test for test in layout.get("tests", []) for source in layout.get("sources", []) if test.startswith(source.rstrip("/") + "/")]
+    if nested and "sonar.tests" in properties:
+        properties["sonar.exclusions"] = ",".join(f"{test}/**" for test in nested)
+    return properties
@@ -0,0 +1,172 @@
+import csv
+import logging
+from datetime import timedelta
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataset import project_rows, as_dict
+import tracing
+
+
+def pyplot():
+    # imported on first use so data collection runs never load matplotlib,
+    # and always on Agg since graphs are only ever written to files
+    import matplotlib
+    matplotlib.use("Agg")
+    import matplotlib.pyplot as plt
+    return plt
+
+
+def save_complexities_graph(project, complexities):
+    plt = pyplot()
+
+    versions = sorted(complexities.keys(), key=lambda x: int(x))
+    x = [int(v) for v in versions]
+    y = [int(complexities[v]) for v in versions]
+
+    fig = plt.figure(figsize=(10, 6))
+    plt.plot(x, y, marker='o', linestyle='-', color='blue')
+    plt.title(f'Cyclomatic Complexity Over {project} Project Versions')
+    plt.xlabel('Version')
+    plt.ylabel('Cyclomatic Complexity')
+    plt.grid(True)
+    plt.xticks(x)
+    plt.tight_layout()
+
+    plt.savefig(f"{project}_cyclomatic_complexity.png")
+    plt.close(fig)
+    logging.info(f"Graph saved as '{project}_cyclomatic_complexity.png'")
+
+def save_test_delays_graph(project, delays, intervals=None):
+    plt = pyplot()
+    delays_in_seconds = {k: v.total_seconds() if isinstance(v, timedelta) else v for k, v in delays.items()}
+
+    sorted_versions = sorted(delays_in_seconds.items(), key=lambda x: int(x[0]))
+    versions = [v[0] for v in sorted_versions]
+    delay_values = [v[1] for v in sorted_versions]
+
+    fig = plt.figure(figsize=(10, 6))
+    if intervals:
+        # error bars span the 95% confidence interval of the median
+        lower = [d - intervals[v][0] if v in intervals else 0 for v, d in zip(versions, delay_values)]
+        upper = [intervals[v][1] - d if v in intervals else 0 for v, d in zip(versions, delay_values)]
+        plt.errorbar(versions, delay_values, yerr=[lower, upper], marker='o', linestyle='-', color='purple', ecolor='gray', capsize=3)
+    else:
+        plt.plot(versions, delay_values, marker='o', linestyle='-', color='purple')
+    plt.title('Delays Between Project Versions')
+    plt.xlabel('Version')
+    plt.ylabel('Delay (seconds)')
+    plt.grid(True)
+    plt.tight_layout()
+
+    plt.savefig(f"{project}_test_delays.png")
+    plt.close(fig)
+    logging.info(f"Graph saved as '{project}_test_delays.png'")
+
+def save_coverage_graph(project, coverages):
+    plt = pyplot()
+    sorted_items = sorted(coverages.items(), key=lambda x: int(x[0]))
+    tests = [key for key, _ in sorted_items]
+    line_coverage = [val["line_coverage"] for _, val in sorted_items]
+    cond_coverage = [val["condition_coverage"] for _, val in sorted_items]
+
+    fig = plt.figure(figsize=(10, 6))
+    plt.plot(tests, line_coverage, marker='o', label='Line Coverage', color='blue')
+    plt.plot(tests, cond_coverage, marker='s', label='Condition Coverage', color='orange')
+
+    plt.title('Test Coverage Over Time')
+    plt.xlabel('Test')
+    plt.ylabel('Coverage (%)')
+    plt.ylim(0, 100)
+    plt.grid(True)
+    plt.legend()
+    plt.tight_layout()
+
+    plt.savefig(f"{project}_coverage.png")
+    plt.close(fig)
+    logging.info(f"Coverage graph saved as '{project}_coverage.png'")
+
+def save_test_counts_graph(project, counts):
+    plt = pyplot()
+    data_sorted = sorted(counts.items(), key=lambda x: int(x[0]))
+
+    x = [test for test, _ in data_sorted]
+    y = [count for _, count in data_sorted]
+
+    fig = plt.figure(figsize=(10, 6))
+    plt.bar(x, y, color='skyblue')
+    plt.xlabel('Test ID')
+    plt.ylabel('Number of Tests')
+    plt.title('Test Counts per ID')
+    plt.xticks(rotation=45)
+    plt.tight_layout()
+
+    plt.savefig(f'{project}_test_counts.png')
+    plt.close(fig)
+    logging.info(f"Graph saved as '{project}_test_counts.png'")
+
+def save_slowest_tests_report(project, slowest):
+    with open(f"{project}_slowest_tests.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["version", "class", "method", "seconds", "outcome"])
+        writer.writerows(slowest)
+    logging.info(f"Report saved as '{project}_slowest_tests.csv'")
+
+
+def save_complexity_deltas_report(project, engine, deltas):
+    with open(f"{project}_{engine}_complexity_deltas.csv", "w", newline="") as f:
+        writer = csv.writer(f)
+        writer.writerow(["from", "to", "path", "before", "after", "delta"])
+        writer.writerows((*row, (row[4] or 0) - (row[3] or 0)) for row in deltas)
+    logging.info(f"Report saved as '{project}_{engine}_complexity_deltas.csv'")
+
+
+def render_jobs(dataset, store, projects, slowest):
+    jobs = []
+    for project in projects:
+        rows = project_rows(dataset, project)
+        line_coverage = as_dict(rows, "line_coverage")
+        condition_coverage = as_dict(rows, "condition_coverage")
+        coverages = {test: {"line_coverage": line_coverage[test], "condition_coverage": condition_coverage.get(test, 0.0)} for test in line_coverage}
+        complexities = as_dict(rows, "complexity")
+        delays = as_dict(rows, "test_seconds")
+        ci_low = as_dict(rows, "test_seconds_ci_low")
+        ci_high = as_dict(rows, "test_seconds_ci_high")
+        intervals = {test: (ci_low[test], ci_high[test]) for test in ci_low if test in ci_high}
+        counts = store.test_counts(project)
+
+        if coverages:
+            jobs.append((save_coverage_graph, project, coverages))
+        if complexities:
+            jobs.append((save_complexities_graph, project, complexities))
+        if delays:
+            jobs.append((save_test_delays_graph, project, delays, intervals))
+            # defects4j's own test runner prints no per-test times, only junit xml or ant summaries have them
+            slowest_tests = store.slowest_tests(project, slowest)
+            if slowest_tests:
+                jobs.append((save_slowest_tests_report, project, slowest_tests))
+            else:
+                logging.info(f"No per-test timings recorded for {project}, skipping '{project}_slowest_tests.csv'")
+        if counts:
+            jobs.append((save_test_counts_graph, project, counts))
+        for engine in ("sonar", "local"):
+            deltas = store.complexity_deltas(project, engine)
+            if deltas:
+                jobs.append((save_complexity_deltas_report, project, engine, deltas))
+    return jobs
+
+
+def render_all(dataset, store, projects, slowest=10, workers=1):
+    """Write every graph and report for the given projects in one pass."""
+    jobs = render_jobs(dataset, store, projects, slowest)
+    if workers <= 1:
+        for func, *args in jobs:
+            with tracing.span("render", args[0], None, job=func.__name__):
+                func(*args)
+        return
+
+    # pyplot keeps global state, so graphs render in separate processes
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        futures = {executor.submit(tracing.timed, *job): job for job in jobs}
+        for future in as_completed(futures):
+            start, wall, cpu = future.result()
+            func, project = futures[future][:2]
+            tracing.record("render", start, wall, cpu, project, job=func.__name__)
@@ -0,0 +1,385 @@
+import os
+import json
+import time
+import hashlib
+import sqlite3
+import threading
+import subprocess
+from datetime import timedelta
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS results (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    metric TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    tree_hash TEXT NOT NULL,
+    value TEXT NOT NULL,
+    recorded_at REAL NOT NULL,
+    PRIMARY KEY (project, version, metric)
+);
+CREATE TABLE IF NOT EXISTS test_cases (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    class TEXT NOT NULL,
+    method TEXT NOT NULL,
+    time REAL,
+    outcome TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS test_cases_version ON test_cases (project, version);
+CREATE TABLE IF NOT EXISTS durations (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS durations_stage ON durations (stage);
+CREATE TABLE IF NOT EXISTS failures (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    PRIMARY KEY (project, version)
+);
+CREATE TABLE IF NOT EXISTS timeouts (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    stage TEXT NOT NULL,
+    reason TEXT NOT NULL,
+    seconds REAL NOT NULL,
+    recorded_at REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS test_inventory (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    mtime_ns INTEGER NOT NULL,
+    size INTEGER NOT NULL,
+    count INTEGER NOT NULL,
+    PRIMARY KEY (project, version)
+);
+CREATE TABLE IF NOT EXISTS test_inventory_entries (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    class TEXT NOT NULL,
+    method TEXT NOT NULL
+);
+CREATE INDEX IF NOT EXISTS test_inventory_entries_version ON test_inventory_entries (project, version);
+CREATE TABLE IF NOT EXISTS coverage_packages (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    package TEXT NOT NULL,
+    lines_total INTEGER NOT NULL,
+    lines_covered INTEGER NOT NULL,
+    conditions_total INTEGER NOT NULL,
+    conditions_covered INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS coverage_classes (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    package TEXT NOT NULL,
+    class TEXT NOT NULL,
+    filename TEXT NOT NULL,
+    lines_total INTEGER NOT NULL,
+    lines_covered INTEGER NOT NULL,
+    conditions_total INTEGER NOT NULL,
+    conditions_covered INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS coverage_lines (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    package TEXT NOT NULL,
+    class TEXT NOT NULL,
+    line INTEGER NOT NULL,
+    hits INTEGER NOT NULL,
+    conditions_total INTEGER NOT NULL,
+    conditions_covered INTEGER NOT NULL
+);
+CREATE TABLE IF NOT EXISTS file_complexity (
+    hash TEXT NOT NULL,
+    fingerprint TEXT NOT NULL,
+    complexity INTEGER NOT NULL,
+    functions INTEGER NOT NULL,
+    PRIMARY KEY (hash, fingerprint)
+);
+CREATE TABLE IF NOT EXISTS version_files (
+    project TEXT NOT NULL,
+    version TEXT NOT NULL,
+    engine TEXT NOT NULL,
+    path TEXT NOT NULL,
+    hash TEXT NOT NULL,
+    complexity INTEGER NOT NULL
+);
+CREATE INDEX IF NOT EXISTS version_files_version ON version_files (project, version, engine);
+CREATE INDEX IF NOT EXISTS coverage_packages_version ON coverage_packages (project, version);
+CREATE INDEX IF NOT EXISTS coverage_classes_version ON coverage_classes (project, version);
+CREATE INDEX IF NOT EXISTS coverage_lines_version ON coverage_lines (project, version)
+"""
+COVERAGE_TABLES = {"package": "coverage_packages", "class": "coverage_classes", "line": "coverage_lines"}
+COVERAGE_BATCH = 10000
+
+
+def tool_fingerprint(binary):
+    # defects4j is normally a git checkout; sonar-scanner ships versioned jars in lib/
+    root = os.path.dirname(os.path.dirname(os.path.realpath(binary)))
+    result = subprocess.run(["git", "-C", root, "rev-parse", "HEAD"], capture_output=True, text=True)
+    if result.returncode == 0:
+        return result.stdout.strip()
+
+    digest = hashlib.sha1(os.path.realpath(binary).encode())
+    try:
+        stat = os.stat(binary)
+        digest.update(f"{stat.st_size}:{stat.st_mtime_ns}".encode())
+    except OSError:
+        pass
+    lib = os.path.join(root, "lib")
+    if os.path.isdir(lib):
+        digest.update("\n".join(sorted(os.listdir(lib))).encode())
+    return digest.hexdigest()
+
+
+def tree_hash(cwd):
+    result = subprocess.run(["git", "-C", cwd, "rev-parse", "HEAD^{tree}"], capture_output=True, text=True)
+    if result.returncode == 0:
+        return result.stdout.strip()
+
+    digest = hashlib.sha1()
+    for root, dirs, files in os.walk(cwd):
+        dirs.sort()
+        for name in sorted(files):
+            if name.endswith(".java"):
+                stat = os.stat(os.path.join(root, name))
+                digest.update(f"{os.path.relpath(os.path.join(root, name), cwd)}:{stat.st_size}:{stat.st_mtime_ns}\n".encode())
+    return digest.hexdigest()
+
+
+def encode(value):
+    if isinstance(value, timedelta):
+        return json.dumps(value.total_seconds())
+    return json.dumps(value)
+
+
+class ResultStore:
+    """SQLite record of every per-version result, written as soon as it is produced.
+
+    A result is reused on a later run only while the tool that produced it
+    and the checkout's source tree are unchanged.
+    """
+
+    def __init__(self, path, tools, force=False, shared=False):
+        self.tools = tools
+        self.force = force
+        self.lock = threading.Lock()
+        self.tree_hashes = {}
+        self.db = sqlite3.connect(path, timeout=60, check_same_thread=False)
+        # WAL needs every connection on one host, so a database shared over
+        # a network filesystem keeps the rollback journal
+        self.db.execute("PRAGMA journal_mode=" + ("DELETE" if shared else "WAL"))
+        self.db.executescript(SCHEMA)
+        self.db.commit()
+
+    def close(self):
+        with self.lock:
+            self.db.close()
+
+    def tree_hash(self, cwd):
+        if cwd is None:
+            return ""
+        if cwd not in self.tree_hashes:
+            self.tree_hashes[cwd] = tree_hash(cwd)
+        return self.tree_hashes[cwd]
+
+    def lookup(self, project, version, metric, tool, cwd=None):
+        if self.force:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT fingerprint, tree_hash, value FROM results WHERE project=? AND version=? AND metric=?",
+                (project, version, metric),
+            ).fetchone()
+        if row is None:
+            return None
+        fingerprint, recorded_tree, value = row
+        if fingerprint != self.tools.get(tool, "") or recorded_tree != self.tree_hash(cwd):
+            return None
+        return json.loads(value)
+
+    def recorded(self, project, version, metric, tool):
+        """Like lookup, but whatever the checkout holds now, for versions whose working tree was evicted."""
+        if self.force:
+            return None
+        with self.lock:
+            row = self.db.execute(
+                "SELECT fingerprint, value FROM results WHERE project=? AND version=? AND metric=?",
+                (project, version, metric),
+            ).fetchone()
+        if row is None or row[0] != self.tools.get(tool, ""):
+            return None
+        return json.loads(row[1])
+
+    def record(self, project, version, metric, tool, value, cwd=None):
+        row = (project, version, metric, self.tools.get(tool, ""), self.tree_hash(cwd), encode(value), time.time())
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO results VALUES (?, ?, ?, ?, ?, ?, ?)", row)
+            self.db.commit()
+
+    def load(self, project, metric):
+        with self.lock:
+            rows = self.db.execute("SELECT version, value FROM results WHERE project=? AND metric=?", (project, metric)).fetchall()
+        return {version: json.loads(value) for version, value in rows}
+
+    def record_tests(self, project, version, rows):
+        with self.lock:
+            self.db.execute("DELETE FROM test_cases WHERE project=? AND version=?", (project, version))
+            self.db.executemany(
+                "INSERT INTO test_cases VALUES (?, ?, ?, ?, ?, ?)",
+                [(project, version, row["class"], row["method"], row["time"], row["outcome"]) for row in rows],
+            )
+            self.db.commit()
+
+    def slowest_tests(self, project, n):
+        # rank inside sqlite so only the top n rows per version come back
+        query = """
+            SELECT version, class, method, time, outcome FROM (
+                SELECT *, ROW_NUMBER() OVER (PARTITION BY version ORDER BY time DESC) AS rank
+                FROM test_cases WHERE project=? AND time IS NOT NULL
+            ) WHERE rank <= ? ORDER BY CAST(version AS INTEGER), rank
+        """
+        with self.lock:
+            return self.db.execute(query, (project, n)).fetchall()
+
+    def record_duration(self, project, version, stage, seconds):
+        with self.lock:
+            self.db.execute("INSERT INTO durations VALUES (?, ?, ?, ?, ?)", (project, version, stage, seconds, time.time()))
+            # the stage has now finished, an earlier timeout of it no longer holds
+            self.db.execute("DELETE FROM timeouts WHERE project=? AND version=? AND stage=?", (project, version, stage))
+            self.db.commit()
+
+    def durations(self, stage):
+        with self.lock:
+            rows = self.db.execute(
+                "SELECT project, version, AVG(seconds) FROM durations WHERE stage=? GROUP BY project, version", (stage,)
+            ).fetchall()
+        return {(project, version): seconds for project, version, seconds in rows}
+
+    def record_timeout(self, project, version, stage, reason, seconds):
+        with self.lock:
+            self.db.execute("INSERT INTO timeouts VALUES (?, ?, ?, ?, ?, ?)", (project, version, stage, reason, seconds, time.time()))
+            self.db.commit()
+
+    def timeouts(self):
+        # stages that timed out and have not finished since; workers on other
+        # hosts record theirs here too, so a coordinator sees every one
+        with self.lock:
+            return self.db.execute("SELECT project, version, stage, reason, seconds FROM timeouts ORDER BY recorded_at").fetchall()
+
+    def record_failures(self, projects, failures):
+        # the last run's failures replace those recorded for its projects
+        with self.lock:
+            self.db.executemany("DELETE FROM failures WHERE project=?", [(project,) for project in projects])
+            self.db.executemany("INSERT OR IGNORE INTO failures VALUES (?, ?)", [(project, version) for project, version in failures if project in projects])
+            self.db.commit()
+
+    def failures(self, projects):
+        with self.lock:
+            rows = self.db.execute("SELECT project, version FROM failures").fetchall()
+        return [(project, version) for project, version in rows if project in projects]
+
+    def record_test_inventory(self, project, version, mtime_ns, size, count, entries):
+        with self.lock:
+            self.db.execute("INSERT OR REPLACE INTO test_inventory VALUES (?, ?, ?, ?, ?)", (project, version, mtime_ns, size, count))
+            self.db.execute("DELETE FROM test_inventory_entries WHERE project=? AND version=?", (project, version))
+            self.db.executemany(
+                "INSERT INTO test_inventory_entries VALUES (?, ?, ?, ?)",
+                [(project, version, test_class, method) for test_class, method in entries],
+            )
+            self.db.commit()
+
+    def test_inventory(self, project):
+        with self.lock:
+            rows = self.db.execute("SELECT version, mtime_ns, size, count FROM test_inventory WHERE project=?", (project,)).fetchall()
+        return {version: (mtime_ns, size, count) for version, mtime_ns, size, count in rows}
+
+    def test_counts(self, project):
+        return {version: count for version, (mtime_ns, size, count) in self.test_inventory(project).items()}
+
+    def record_coverage(self, project, version, rows):
+        """Write streamed coverage rows in batches and return the package rows."""
+        with self.lock:
+            for table in COVERAGE_TABLES.values():
+                self.db.execute(f"DELETE FROM {table} WHERE project=? AND version=?", (project, version))
+            self.db.commit()
+
+        pending = {kind: [] for kind in COVERAGE_TABLES}
+        packages = []
+
+        def flush(kind):
+            if not pending[kind]:
+                return
+            columns = ", ".join("?" * (len(pending[kind][0])))
+            with self.lock:
+                self.db.executemany(f"INSERT INTO {COVERAGE_TABLES[kind]} VALUES ({columns})", pending[kind])
+                self.db.commit()
+            pending[kind] = []
+
+        for kind, *values in rows:
+            pending[kind].append((project, version, *values))
+            if kind == "package":
+                packages.append(values)
+            if len(pending[kind]) >= COVERAGE_BATCH:
+                flush(kind)
+        for kind in COVERAGE_TABLES:
+            flush(kind)
+        return packages
+
+    def file_complexities(self, hashes, tool):
+        """Cached (complexity, functions) of each file content hash the tool already analysed."""
+        fingerprint = self.tools.get(tool, "")
+        found = {}
+        hashes = list(hashes)
+        with self.lock:
+            # stay below sqlite's bound parameter limit
+            for start in range(0, len(hashes), 500):
+                page = hashes[start:start+500]
+                rows = self.db.execute(
+                    f"SELECT hash, complexity, functions FROM file_complexity WHERE fingerprint=? AND hash IN ({','.join('?' * len(page))})",
+                    (fingerprint, *page),
+                ).fetchall()
+                found.update({digest: (complexity, functions) for digest, complexity, functions in rows})
+        return found
+
+    def record_file_complexities(self, tool, rows):
+        fingerprint = self.tools.get(tool, "")
+        with self.lock:
+            self.db.executemany(
+                "INSERT OR REPLACE INTO file_complexity VALUES (?, ?, ?, ?)",
+                [(digest, fingerprint, complexity, functions) for digest, complexity, functions in rows],
+            )
+            self.db.commit()
+
+    def record_version_files(self, project, version, engine, rows):
+        with self.lock:
+            self.db.execute("DELETE FROM version_files WHERE project=? AND version=? AND engine=?", (project, version, engine))
+            self.db.executemany(
+                "INSERT INTO version_files VALUES (?, ?, ?, ?, ?, ?)",
+                [(project, version, engine, path, digest, complexity) for path, digest, complexity in rows],
+            )
+            self.db.commit()
+
+    def version_files(self, project, engine):
+        with self.lock:
+            rows = self.db.execute("SELECT version, path, complexity FROM version_files WHERE project=? AND engine=?", (project, engine)).fetchall()
+        files = {}
+        for version, path, complexity in rows:
+            files.setdefault(version, {})[path] = complexity
+        return files
+
+    def complexity_deltas(self, project, engine):
+        """(from, to, path, before, after) for every file whose complexity changed between consecutive versions."""
+        files = self.version_files(project, engine)
+        versions = sorted(files, key=int)
+        deltas = []
+        for previous, version in zip(versions, versions[1:]):
+            before, after = files[previous], files[version]
+            for path in sorted(set(before) | set(after)):
+                if before.get(path) != after.get(path):
+                    deltas.append((previous, version, path, before.get(path), after.get(path)))
+        return deltas
@@ -0,0 +1,129 @@
+import os
+import re
+import time
+import signal
+import threading
+import subprocess
+from collections import deque
+from dataclasses import dataclass, field
+import tracing
+
+TAIL_LINES = 20
+WATCHDOG_INTERVAL = 1.0
+# seconds a process group gets to exit on SIGTERM before it is killed
+KILL_GRACE = 10.0
+
+
+@dataclass
+class CommandResult:
+    returncode: int
+    wall_time: float
+    log_path: str
+    cpu_time: float = 0.0
+    max_rss_kb: int = 0
+    matches: dict = field(default_factory=dict)
+    tail: list = field(default_factory=list)
+    # "timeout" or "idle" when the watchdog killed the command
+    timed_out: str = None
+
+    @property
+    def ok(self):
+        return self.returncode == 0 and self.timed_out is None
+
+
+def compile_matchers(patterns):
+    return {name: re.compile(pattern) for name, pattern in (patterns or {}).items()}
+
+
+def kill_group(pgid, sig):
+    try:
+        os.killpg(pgid, sig)
+    except ProcessLookupError:
+        pass
+
+
+class Watchdog:
+    """Kills a command's process group once it runs past timeout, or goes idle_timeout seconds without printing a line.
+
+    The group holds everything the command started, so ant's forked JVMs
+    and the scanner's JVM die with it instead of holding the pipe open.
+    """
+
+    def __init__(self, pgid, timeout=None, idle_timeout=None):
+        self.pgid = pgid
+        self.timeout = timeout
+        self.idle_timeout = idle_timeout
+        self.started = self.last_output = time.monotonic()
+        self.reason = None
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.watch, daemon=True)
+        if timeout or idle_timeout:
+            self.thread.start()
+
+    def touch(self):
+        self.last_output = time.monotonic()
+
+    def watch(self):
+        while not self.stopped.wait(WATCHDOG_INTERVAL):
+            now = time.monotonic()
+            if self.timeout and now - self.started > self.timeout:
+                self.reason = "timeout"
+            elif self.idle_timeout and now - self.last_output > self.idle_timeout:
+                self.reason = "idle"
+            else:
+                continue
+            kill_group(self.pgid, signal.SIGTERM)
+            if not self.stopped.wait(KILL_GRACE):
+                kill_group(self.pgid, signal.SIGKILL)
+            return
+
+    def stop(self):
+        self.stopped.set()
+
+
+def run_command(argv, cwd=None, log_path=os.devnull, matchers=None, timeout=None, idle_timeout=None):
+    # output goes straight to the log file; only the first match of every
+    # matcher and the last few lines are kept in memory
+    matchers = compile_matchers(matchers)
+    matches = {}
+    tail = deque(maxlen=TAIL_LINES)
+
+    if log_path != os.devnull:
+        os.makedirs(os.path.dirname(log_path), exist_ok=True)
+
+    start = time.monotonic()
+    with open(log_path, "w", encoding="utf-8") as log:
+        # a session of its own makes the child the leader of a new process group
+        process = subprocess.Popen(argv, cwd=cwd, stdout=subprocess.PIPE, stderr=subprocess.STDOUT, text=True, errors="replace", start_new_session=True)
+        watchdog = Watchdog(process.pid, timeout, idle_timeout)
+        try:
+            for line in process.stdout:
+                watchdog.touch()
+                log.write(line)
+                tail.append(line.rstrip("\n"))
+                for name, pattern in matchers.items():
+                    if name in matches:
+                        continue
+                    match = pattern.search(line)
+                    if match:
+                        matches[name] = match.group(1) if match.groups() else match.group(0)
+            # wait4 reaps the child together with the resources of everything it
+            # waited on, which for defects4j includes the ant and JVM children
+            pid, status, rusage = os.wait4(process.pid, 0)
+        except BaseException:
+            # the group no longer gets the terminal's SIGINT, so take it down here
+            kill_group(process.pid, signal.SIGKILL)
+            process.wait()
+            raise
+        finally:
+            watchdog.stop()
+        wall_time = time.monotonic() - start
+        process.returncode = returncode = os.waitstatus_to_exitcode(status)
+        if watchdog.reason is not None:
+            # whatever outlived the leader after SIGTERM
+            kill_group(process.pid, signal.SIGKILL)
+            log.write(f"\nkilled by the watchdog: {watchdog.reason} after {wall_time:.0f}s\n")
+
+    cpu_time = rusage.ru_utime + rusage.ru_stime
+    tracing.add_child(cpu_time, rusage.ru_maxrss)
+    return CommandResult(returncode, wall_time, log_path, cpu_time, rusage.ru_maxrss, matches, list(tail), watchdog.reason)
@@ -0,0 +1,93 @@
+import os
+import heapq
+import logging
+
+# seconds a stage's command may run before it is killed, until the stage has history
+DEFAULT_TIMEOUTS = {
+    "info": 600,
+    "checkout": 1800,
+    "export": 600,
+    "compile": 1800,
+    "test": 10800,
+    "coverage": 10800,
+    "scan": 3600,
+}
+# with history, a multiple of the slowest version ever recorded
+TIMEOUT_FACTOR = 4
+TIMEOUT_FLOOR = 600
+
+
+def source_size(cwd):
+    size = 0
+    for root, dirs, files in os.walk(cwd):
+        dirs[:] = [d for d in dirs if not d.startswith(".")]
+        for name in files:
+            if name.endswith(".java"):
+                try:
+                    size += os.path.getsize(os.path.join(root, name))
+                except OSError:
+                    pass
+    return size
+
+
+def estimate_durations(versions, history, size_of):
+    """Expected seconds per version, and whether the estimates are in seconds.
+
+    Versions without history are estimated from their source size, scaled by
+    the seconds per byte of the versions that do have history. On a first
+    run nothing has history and the raw sizes are only good for ordering.
+    """
+    known = {version: history[version] for version in versions if version in history}
+    unknown = [version for version in versions if version not in known]
+    if not unknown:
+        return known, True
+
+    sizes = {version: size_of(version) for version in unknown}
+    if not known:
+        return sizes, False
+
+    known_size = sum(size_of(version) for version in known)
+    if known_size:
+        rate = sum(known.values()) / known_size
+        estimates = {version: size * rate for version, size in sizes.items()}
+    else:
+        average = sum(known.values()) / len(known)
+        estimates = {version: average for version in unknown}
+    estimates.update(known)
+    return estimates, True
+
+
+def longest_first(versions, estimates):
+    return sorted(versions, key=lambda version: estimates.get(version, 0), reverse=True)
+
+
+def predict_makespan(durations, jobs):
+    # greedy list scheduling, which is what a pool fed in this order does
+    loads = [0.0] * max(1, jobs)
+    for duration in sorted(durations, reverse=True):
+        heapq.heapreplace(loads, loads[0] + duration)
+    return max(loads)
+
+
+def plan(versions, history, size_of, jobs):
+    estimates, in_seconds = estimate_durations(versions, history, size_of)
+    ordered = longest_first(versions, estimates)
+    predicted = predict_makespan([estimates[version] for version in versions], jobs) if in_seconds else None
+    if predicted is None:
+        logging.info(f"no duration history yet, ordering {len(versions)} versions by source size")
+    return ordered, predicted
+
+
+def stage_timeouts(durations, overrides=None):
+    """Seconds each stage's commands may run, from durations(stage) history or DEFAULT_TIMEOUTS.
+
+    A stage's recorded duration covers all of its commands for a version
+    (every test repeat, the scan and its analysis), so the limit derived
+    from it is a loose one per command. Overrides of 0 disable the limit.
+    """
+    timeouts = {}
+    for stage, default in DEFAULT_TIMEOUTS.items():
+        history = durations(stage)
+        timeouts[stage] = max(TIMEOUT_FLOOR, TIMEOUT_FACTOR * max(history.values())) if history else default
+    timeouts.update(overrides or {})
+    return {stage: seconds for stage, seconds in timeouts.items() if seconds > 0}
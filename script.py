@@ -1,14 +1,26 @@
 import argparse
-import matplotlib.pyplot as plt
-from datetime import datetime, timedelta
 import time
-import requests
-import re
-import subprocess
+from datetime import datetime, timedelta
 import os
 import logging
 import getpass
-from tqdm import tqdm
+from workers import run_versions, run_pipeline, process_pool, describe
+from jobqueue import JobQueue, run_worker, wait_for_jobs, worker_name
+import tracing
+from sonarqube import SONAR_URL, SonarQubeClient, SonarQubeError, clear_report_task, project_key
+from results import ResultStore, tool_fingerprint
+from runner import run_command
+from admission import AdmissionController, memory_budgets
+from timing import summarize_samples
+from junit_reports import collect_test_cases
+from scheduler import plan, source_size, stage_timeouts
+from dataset import CORRELATED, build_dataset, save_dataset, drop_failed, correlations, save_correlations
+from render import render_all
+from cobertura import iter_coverage, summarize_packages
+from workspace import WorkspaceBudget, place, tree_size
+from checkouts import is_valid_checkout, share_objects
+from layout import detect_layout, scanner_properties
+from complexity import analyze_incremental, engine_fingerprint, hash_file
 
 AVAILABLE_PROJECTS = ["Csv","Jsoup","Mockito","Time","Math"]
 DEFECTS4J_CHECKOUT = "checkout -p {} -v {} -w {}"
@@ -16,8 +28,27 @@ DEFECTS4J_COMPILE = "compile"
 DEFECTS4J_TEST = "test"
 DEFECTS4J_COVERAGE = "coverage"
 DEFECTS4J_PATH_TEST = "info -p Lang"
+COVERAGE_MATCHERS = {
+    "lines_total": r"Lines total:\s*(\d+)",
+    "lines_covered": r"Lines covered:\s*(\d+)",
+    "conditions_total": r"Conditions total:\s*(\d+)",
+    "conditions_covered": r"Conditions covered:\s*(\d+)",
+    "line_coverage": r"Line coverage:\s*([\d.]+)%",
+    "condition_coverage": r"Condition coverage:\s*([\d.]+)%",
+}
+SCANNER_MATCHERS = {
+    "error": r"ERROR: (.*)",
+}
+STAGES = ["checkout","compile","coverage","complexity","test"]
 user_token = None
 project_token = None
+sonar_client = None
+store = None
+admission = None
+budget = None
+scratch = None
+timeouts = {}
+idle_timeouts = {}
 logging.basicConfig(
     level=logging.DEBUG,  # Set logging level (DEBUG, INFO, WARNING, ERROR, CRITICAL)
     format="%(asctime)s - %(levelname)s - %(message)s",  # Log format
@@ -25,49 +56,120 @@ logging.basicConfig(
 
 failures = []
 
+def stage_list(value):
+    stages = [stage.strip() for stage in value.split(",") if stage.strip()]
+    unknown = [stage for stage in stages if stage not in STAGES]
+    if unknown:
+        raise argparse.ArgumentTypeError(f"unknown stages {unknown}, expected some of {STAGES}")
+    return stages
+
+def positive_int(value):
+    number = int(value)
+    if number < 1:
+        raise argparse.ArgumentTypeError(f"{value} is not at least 1")
+    return number
+
+def stage_counts(value):
+    # "test=2,scan=4"
+    counts = {}
+    for item in value.split(","):
+        if item.strip():
+            stage, count = item.split("=")
+            counts[stage.strip()] = int(count)
+    return counts
+
 def arguments():
     parser = argparse.ArgumentParser(description="arguments to automate data collection")
 
     parser.add_argument("-w", required=True,type=str, help="directory to create defects4j checkouts")
-    parser.add_argument("-d", required=True,type=str, help="full defects4j binary path")
-    parser.add_argument("-s", required=True,type=str, help="full sonar-scanner binary path")
-    parser.add_argument("-p", required=True,type=str, help="defects4j project to automate")
-    parser.add_argument("-t", required=True,type=str, help="sonarqube user token")
-    parser.add_argument("-k", required=True,type=str, help="sonarqube project token")
+    parser.add_argument("-d", type=str, help="full defects4j binary path")
+    parser.add_argument("-s", type=str, help="full sonar-scanner binary path")
+    parser.add_argument("-p", required=True,type=str, help="defects4j project to automate, a comma separated list or 'all'")
+    parser.add_argument("-t", type=str, help="sonarqube user token")
+    parser.add_argument("-k", type=str, help="sonarqube project token")
+    parser.add_argument("--sonar-url", default=SONAR_URL,type=str, help="sonarqube server the scanner reports to and the api is read from")
+    parser.add_argument("--http-timeout", default=30,type=float, help="seconds before a sonarqube api request times out")
+    parser.add_argument("--http-retries", default=5,type=int, help="retries for sonarqube api requests that fail with 429/5xx")
+    parser.add_argument("--http-concurrency", default=4,type=int, help="maximum sonarqube api requests in flight")
+    parser.add_argument("-j", "--jobs", default=1,type=int, help="number of versions to checkout/compile/test in parallel")
+    parser.add_argument("--stage-workers", default={},type=stage_counts, help="workers per pipeline stage, e.g. test=2,scan=4, defaults to -j")
+    parser.add_argument("--queue-size", default=None,type=int, help="versions waiting in front of each pipeline stage, defaults to its worker count")
+    parser.add_argument("--overlap-tests", action="store_true", help="let other stages run while tests are timed; faster, but the test timings then include their load")
+    parser.add_argument("--stage-barriers", action="store_true", help="run every stage over all versions before starting the next one")
+    parser.add_argument("--role", default="local",choices=["local", "coordinator", "worker"], help="run everything here, or publish jobs to / serve jobs from a shared queue")
+    parser.add_argument("--queue", default=None,type=str, help="job queue database on storage shared by all hosts, defaults to <w>/jobs.db")
+    parser.add_argument("--lease", default=600,type=float, help="seconds a worker may hold a job without renewing before it is handed to another worker")
+    parser.add_argument("--adaptive", action="store_true", help="admit defects4j/sonar-scanner runs by cgroup cpu/memory limits and load, -j becomes the upper bound")
+    parser.add_argument("--timeout", default={},type=stage_counts, help="seconds a stage's command may run before its process group is killed, e.g. test=7200,scan=1800, 0 for no limit; defaults come from earlier runs' durations")
+    parser.add_argument("--idle-timeout", default={},type=stage_counts, help="seconds a stage's command may go without printing a line before it is killed, e.g. scan=600,compile=900")
+    parser.add_argument("--memory-budget", default={},type=memory_budgets, help="starting memory per command of a stage in MB, e.g. scan=3072,test=2048")
+    parser.add_argument("--warmup", default=0,type=int, help="untimed defects4j test runs per version before measuring")
+    parser.add_argument("--repeat", default=1,type=positive_int, help="timed defects4j test runs per version")
+    parser.add_argument("--slowest", default=10,type=int, help="slowest tests per version to list in <project>_slowest_tests.csv; only written when the tests report their times in junit xml or ant summaries, which defects4j test does not")
+    parser.add_argument("--only", default=",".join(STAGES),type=stage_list, help=f"comma separated stages to run ({','.join(STAGES)})")
+    parser.add_argument("--complexity-engine", default="sonar",choices=["sonar", "local"], help="measure cyclomatic complexity with sonar-scanner or the built-in analyzer")
+    parser.add_argument("--private-objects", action="store_true", help="keep a full git object store in every checkout instead of sharing one per project")
+    parser.add_argument("--disk-budget", default=None,type=float, help="GB the live working trees may take; finished versions are evicted to make room")
+    parser.add_argument("--max-live", default=None,type=int, help="working trees allowed at once; finished versions are evicted to make room")
+    parser.add_argument("--evict", default="prune",choices=["prune", "archive"], help="delete finished working trees, or compress them to <w>/archive first")
+    parser.add_argument("--tmpfs", default=None,type=str, help="directory, e.g. on tmpfs, to hold the working trees, linked from <w>")
+    parser.add_argument("--cache", default=None,type=str, help="results database, defaults to <w>/results.db")
+    parser.add_argument("--force", action="store_true", help="ignore cached results and rerun every selected stage")
+    parser.add_argument("--render-only", action="store_true", help="only redraw the graphs and reports from the results database")
 
     args = parser.parse_args()
+    if not args.render_only:
+        missing = [f"-{flag}" for flag in ["d", "s", "t", "k"] if getattr(args, flag) is None]
+        if missing:
+            parser.error(f"the following arguments are required: {', '.join(missing)}")
+    if (args.disk_budget or args.max_live) and (args.stage_barriers or args.role != "local"):
+        parser.error("--disk-budget and --max-live evict versions as the local pipeline finishes them, they cannot be used with --stage-barriers or --role")
 
     return args
 
-def execute_command(path,command,cwd=None):
-    if cwd is None:
-        result = subprocess.run([path+"/defects4j"]+command, capture_output=True,text=True)
-    else:
-        result = subprocess.run([path+"/defects4j"]+command, capture_output=True,text=True, cwd=cwd)
+def version_dir(w, project, test):
+    return w+"/"+project+"/345/"+test
 
-    stdout = result.stdout
-    stderr = result.stderr
+def schedule(stage, versions, w, jobs):
+    global store
+    # longest versions first, from earlier runs' durations or the source size
+    return plan(versions, store.durations(stage), lambda version: source_size(version_dir(w, *version)), jobs)
 
-    return (True,stderr+stdout)
+def log_path(w, project, test, stage):
+    return w+"/logs/"+project+"/"+test+"/"+stage+".log"
 
-def execute_scanner(path,command,cwd=None):
-    if cwd is None:
-        result = subprocess.run([path+"/sonar-scanner"]+command, capture_output=True,text=True)
-    else:
-        result = subprocess.run([path+"/sonar-scanner"]+command, capture_output=True,text=True, cwd=cwd)
+def run_admitted(stage, argv, cwd, log, matchers):
+    global admission
+    global timeouts
+    global idle_timeouts
+    limits = {"timeout": timeouts.get(stage), "idle_timeout": idle_timeouts.get(stage)}
+    if admission is None:
+        return run_command(argv, cwd=cwd, log_path=log, matchers=matchers, **limits)
+    with admission.admit(stage):
+        result = run_command(argv, cwd=cwd, log_path=log, matchers=matchers, **limits)
+    admission.observe(stage, result.max_rss_kb)
+    return result
+
+def execute_command(path,command,cwd=None,log=os.devnull,matchers=None):
+    return run_admitted(command[0], [path+"/defects4j"]+command, cwd, log, matchers)
 
-    stdout = result.stdout
-    stderr = result.stderr
+def execute_scanner(path,command,cwd=None,log=os.devnull,matchers=None):
+    return run_admitted("scan", [path+"/sonar-scanner"]+command, cwd, log, matchers)
 
-    return (True,stderr+stdout)
+def record_timeout(project, test, stage, result):
+    # a distinct outcome, the version is not added to failures
+    global store
+    silence = " without output" if result.timed_out == "idle" else ""
+    logging.error(f"{stage} of {project} {test} was killed after {result.wall_time:.0f}s{silence}, see {result.log_path}")
+    store.record_timeout(project, test, stage, result.timed_out, result.wall_time)
 
 
 def test_defects4j_path(path):
-    status, output = execute_command(path, DEFECTS4J_PATH_TEST.split())
-    if status is False:
-        logging.error(output)
+    result = execute_command(path, DEFECTS4J_PATH_TEST.split())
+    if not result.ok:
+        logging.error("\n".join(result.tail))
 
-    return status
+    return result.ok
 
 
 def is_choosen_project(project):
@@ -83,244 +185,573 @@ def get_project_bugs(path, project):
     return trigger_tests
 
 
-def checkout_all_versions(path, project, trigger_tests, w):
+def reference_dir(w, project):
+    return w+"/"+project+"/reference.git"
+
+def checkout_version(path, project, test, w, share=True):
+    global store
+    global budget
+    cwd = version_dir(w, project, test)
+    # a complete checkout left by an earlier or interrupted run is reused as is
+    if not store.force and is_valid_checkout(cwd, project, test):
+        if not store.lookup(project, test, "checkout", "defects4j"):
+            store.record(project, test, "checkout", "defects4j", True)
+        if budget is not None:
+            budget.measure(project, test, tree_size(cwd))
+        return True
+    if os.path.lexists(cwd):
+        logging.warning(f"discarding incomplete checkout {cwd}")
+    checkout = DEFECTS4J_CHECKOUT.format(project, test+"b", place(cwd, scratch, project, test))
+    result = execute_command(path, checkout.split(), log=log_path(w, project, test, "checkout"))
+    if result.ok:
+        if share:
+            freed = share_objects(cwd, reference_dir(w, project), test)
+            if freed:
+                logging.debug(f"{project} {test}: {freed / 2**20:.0f} MB of git objects now shared")
+        if budget is not None:
+            budget.measure(project, test, tree_size(cwd))
+        store.record(project, test, "checkout", "defects4j", True)
+        store.record_duration(project, test, "checkout", result.wall_time)
+    elif result.timed_out:
+        record_timeout(project, test, "checkout", result)
+    else:
+        logging.error(f"checkout of {project} {test} failed, see {result.log_path}")
+    return result.ok
 
-    for test in tqdm(trigger_tests, desc=f"Checking out all versions of {project}",ncols=100):
-        checkout = DEFECTS4J_CHECKOUT.format(project, test+"b", w+"/345/"+test)
-        status, output = execute_command(path, checkout.split())
+def checkout_all_versions(path, versions, w, jobs=1, share=True):
+    ordered, predicted = schedule("checkout", versions, w, jobs)
+    run_versions(lambda version: checkout_version(path, *version, w, share), ordered, f"Checking out all versions of {describe(versions)}", jobs, predicted, stage="checkout")
 
-def get_tests(w):
-    tests_path = w+"/345/"
+def get_tests(w, project):
+    tests_path = w+"/"+project+"/345/"
+    if not os.path.isdir(tests_path):
+        return []
     return sorted(os.listdir(tests_path))
 
-def fetch_cyclomatic_complexity():
-    global user_token
-    url = "http://localhost:9000/api/measures/component?additionalFields=period%2Cmetrics&component=a&metricKeys=complexity"
-
-    headers = {
-        'Content-Type': 'application/json',
-            'Authorization': f"Bearer {user_token}"
-    }
-    logging.info("user_token="+user_token)
-
-    response = requests.get(url, headers=headers)
-
-    if response.status_code == 200:
-        return response.json()  # Return the JSON response
-    else:
-        logging.error(f"Request failed with status code {response.status_code}")
-        exit()
+def get_layout(path, project, test, w):
+    global store
+    cwd = version_dir(w, project, test)
+    cached = store.lookup(project, test, "layout", "defects4j", cwd)
+    if cached is not None:
+        return cached
+    layout = detect_layout(cwd, lambda command, cwd: execute_command(path, command, cwd=cwd, log=log_path(w, project, test, "export")))
+    # class directories only exist after compiling, so an incomplete guess is retried next time
+    if layout["sources"] and layout["binaries"]:
+        store.record(project, test, "layout", "defects4j", layout, cwd)
+    logging.debug(f"{project} {test} layout: {layout}")
+    return layout
+
+def has_classes(path, project, test, w):
+    # an evicted tree checks out again with the same hash but without its class files
+    cwd = version_dir(w, project, test)
+    return any(os.path.isdir(os.path.join(cwd, binaries)) for binaries in get_layout(path, project, test, w)["binaries"])
+
+def scan_version(path, d4j_path, project, test, w, token):
+    global failures
+    global sonar_client
+    global store
+    cwd = version_dir(w, project, test)
+    key = project_key(project, test)
+    if store.lookup(project, test, "sonar_scan", "sonar-scanner", cwd):
+        return key
+    start = time.monotonic()
+    properties = scanner_properties(get_layout(d4j_path, project, test, w), cwd)
+    if "sonar.sources" not in properties or "sonar.java.binaries" not in properties:
+        logging.error(f"no source or class directories found for {project} {test}, compile it first")
+        failures.append((project, test))
+        return None
+    properties.update({"sonar.projectKey": key, "sonar.host.url": sonar_client.url, "sonar.token": token})
+    try:
+        clear_report_task(cwd)
+        with tracing.span("scanner", project, test):
+            result = execute_scanner(path, [f"-D{name}={value}" for name, value in properties.items()], cwd=cwd, log=log_path(w, project, test, "scan"), matchers=SCANNER_MATCHERS)
+        logging.debug(f"scanned {test} in {result.wall_time:.1f}s, output in {result.log_path}")
+        if result.timed_out:
+            record_timeout(project, test, "scan", result)
+            return None
+        if not result.ok:
+            raise SonarQubeError(result.matches.get("error") or f"sonar-scanner exited with {result.returncode}")
+        sonar_client.wait_for_analysis(cwd)
+    except (SonarQubeError, OSError, KeyError) as e:
+        # OSError/KeyError: the scanner left no usable report-task.txt
+        logging.error(f"scan of {project} {test} failed: {e}, see {log_path(w, project, test, 'scan')}")
+        failures.append((project, test))
+        return None
+    store.record(project, test, "sonar_scan", "sonar-scanner", True, cwd)
+    store.record_duration(project, test, "scan", time.monotonic() - start)
+    return key
+
+
+def record_file_measures(project, test, w, key):
+    global sonar_client
+    global store
+    cwd = version_dir(w, project, test)
+    try:
+        files = sonar_client.fetch_file_measures(key)
+    except SonarQubeError as e:
+        logging.warning(f"no per-file complexities for {test}: {e}")
+        return
+    rows = []
+    for path, values in files.items():
+        if "complexity" in values and os.path.isfile(os.path.join(cwd, path)):
+            rows.append((path, hash_file(os.path.join(cwd, path)), int(float(values["complexity"])), int(float(values.get("functions", 0)))))
+    store.record_file_complexities("sonar-scanner", [(digest, complexity, functions) for path, digest, complexity, functions in rows])
+    store.record_version_files(project, test, "sonar", [(path, digest, complexity) for path, digest, complexity, functions in rows])
 
 
-def get_cyclomatic_complexity(path, project, trigger_tests, w, token):
-    complexities = {}
+def get_cyclomatic_complexity(path, d4j_path, versions, w, token, jobs=1):
     global failures
+    global sonar_client
+    global store
+
+    measures = {}
+    for project, test in versions:
+        cached = store.lookup(project, test, "sonar_measures", "sonar-scanner", version_dir(w, project, test))
+        if cached is not None:
+            measures[(project, test)] = cached
+    pending = [version for version in versions if version not in measures]
+
+    # every version has its own project key, so scans no longer overwrite each other
+    ordered, predicted = schedule("scan", pending, w, jobs)
+    keys = run_versions(lambda version: scan_version(path, d4j_path, *version, w, token), ordered, f"Calculating cyclomatic complexities for {describe(versions)}", jobs, predicted, stage="scan")
+    keys = {version: key for version, key in keys.items() if key is not None}
+    logging.info("Completed scanning versions")
 
-    for test in tqdm(trigger_tests, desc=f"Calculating cyclomatic complexities for {project}", ncols=100):
-        try:
-            cwd = w+"/345/"+test
-            status, output = execute_scanner(path,f"-Dsonar.projectKey=a -Dsonar.sources=. -Dsonar.host.url=http://localhost:9000 -Dsonar.token={token} -Dsonar.java.binaries=target/classes".split(), cwd=cwd)
-
-            logging.error(test)
-            logging.error(output)
-            print("aaaaa")
-            print("No files nor directories matching 'target/classes'" in output)
-            if "No files nor directories matching 'target/classes'" in output:
-                loggin.error("trying target")
-                raise Exception("aa")
-            time.sleep(3)
-            data = fetch_cyclomatic_complexity()
-            complexities[test] = data['component']['measures'][0]['value']
-        except Exception as e:
-            logging.info("trying second option")
-            try:
-                print("running")
-                status, output = execute_scanner(path,f"-Dsonar.projectKey=a -Dsonar.sources=. -Dsonar.host.url=http://localhost:9000 -Dsonar.token={token} -Dsonar.java.binaries=build/classes".split(), cwd=cwd)
-                print("waiting")
-                logging.error(test)
-                logging.error(output)
-                time.sleep(3)
-                data = fetch_cyclomatic_complexity()
-                complexities[test] = data['component']['measures'][0]['value']
-            except Exception as e:
-                logging.error("netiher worked")
-                failures.append(test)
+    try:
+        by_key = sonar_client.fetch_measures(list(keys.values()))
+    except SonarQubeError as e:
+        logging.error(e)
+        failures.extend(keys)
+        by_key = {}
 
+    for (project, test), key in keys.items():
+        if by_key.get(key):
+            measures[(project, test)] = by_key[key]
+            store.record(project, test, "sonar_measures", "sonar-scanner", by_key[key], version_dir(w, project, test))
 
+    run_versions(lambda version: record_file_measures(*version, w, keys[version]), list(keys), f"Collecting per-file complexities for {describe(versions)}", jobs, stage="file_measures")
+
+    complexities = {}
+    for version, values in measures.items():
+        if "complexity" in values:
+            complexities[version] = values["complexity"]
+        else:
+            failures.append(version)
 
-    logging.info("Completed scanning versions")
     logging.info(complexities)
-    return complexities
+    return complexities, measures
   
-def get_coverage(path, project, trigger_tests,w):
+def get_version_local_complexity(path, project, test, w, executor):
+    global store
+    cwd = version_dir(w, project, test)
+    cached = store.lookup(project, test, "local_measures", "complexity-engine", cwd)
+    if cached is not None:
+        return cached
+    start = time.monotonic()
+    layout = get_layout(path, project, test, w)
+    measures = analyze_incremental(store, project, test, cwd, layout["sources"] or ["."], executor)
+    store.record(project, test, "local_measures", "complexity-engine", measures, cwd)
+    store.record_duration(project, test, "local_complexity", time.monotonic() - start)
+    return measures
+
+
+def get_local_complexity(path, versions, w, jobs=1):
+    # versions are spread over threads, their files over one shared process pool
+    with process_pool(jobs) as executor:
+        measures = run_versions(lambda version: get_version_local_complexity(path, *version, w, executor), versions, f"Analysing cyclomatic complexities for {describe(versions)}", jobs, stage="local_complexity")
+    complexities = {version: values["complexity"] for version, values in measures.items()}
+    logging.info(complexities)
+    return complexities, measures
+
+
+def measure_version(path, d4j_path, project, test, w, token):
+    global failures
+    global sonar_client
+    global store
+    # the project measures are fetched for every scanned version at once, see fetch_scanned_measures
+    cwd = version_dir(w, project, test)
+    if store.lookup(project, test, "sonar_measures", "sonar-scanner", cwd) is not None:
+        return project_key(project, test)
+    key = scan_version(path, d4j_path, project, test, w, token)
+    if key is not None:
+        record_file_measures(project, test, w, key)
+    return key
+
+
+def fetch_scanned_measures(versions, w):
     global failures
-    coverages = {}
-    for test in tqdm(trigger_tests, desc=f"Calculating coverages for {project}", ncols=100):
-        try:
-            cwd = w+"/345/"+test
-            status, output = execute_command(path, DEFECTS4J_COVERAGE.split(), cwd=cwd)
-
-            pattern = r"Lines total:\s*(\d+)\s*Lines covered:\s*(\d+)\s*Conditions total:\s*(\d+)\s*Conditions covered:\s*(\d+)\s*Line coverage:\s*([\d.]+)%\s*Condition coverage:\s*([\d.]+)%"
-            
-            match = re.search(pattern, output)
-
-            if match is None:
-                logging.error("Failed to capture coverage")
-            lines_total = int(match.group(1))
-            lines_covered = int(match.group(2))
-            conditions_total = int(match.group(3))
-            conditions_covered = int(match.group(4))
-            line_coverage = float(match.group(5))
-            condition_coverage = float(match.group(6))
-            coverages[test] = {
-                "line_coverage":line_coverage,
-                "condition_coverage":condition_coverage
-            }
-        except Exception as e:
-            failures.append(test)
+    global sonar_client
+    global store
+    keys = {}
+    for project, test in versions:
+        cwd = version_dir(w, project, test)
+        if store.lookup(project, test, "sonar_scan", "sonar-scanner", cwd) and store.lookup(project, test, "sonar_measures", "sonar-scanner", cwd) is None:
+            keys[(project, test)] = project_key(project, test)
+    if not keys:
+        return
+    try:
+        by_key = sonar_client.fetch_measures(list(keys.values()))
+    except SonarQubeError as e:
+        logging.error(e)
+        failures.extend(keys)
+        return
+    for (project, test), key in keys.items():
+        if "complexity" not in by_key[key]:
+            failures.append((project, test))
+            continue
+        store.record(project, test, "sonar_measures", "sonar-scanner", by_key[key], version_dir(w, project, test))
+
+
+def stage_pipeline(path, scanner, w, stages, args, executor):
+    # each version moves on as soon as its own prerequisites are done; test
+    # and coverage both run defects4j in the checkout, so they never overlap,
+    # and the scan waits for both so it never reads classes they rebuild; the
+    # local analyzer only reads sources
+    workers = lambda stage: args.stage_workers.get(stage, args.jobs)
+    pipeline = []
+    if "checkout" in stages:
+        pipeline.append(("checkout", lambda version: checkout_version(path, *version, w, not args.private_objects), workers("checkout"), []))
+    if "compile" in stages:
+        pipeline.append(("compile", lambda version: compile_version(path, *version, w), workers("compile"), ["checkout"]))
+    if "test" in stages:
+        pipeline.append(("test", lambda version: get_version_testing_time(path, *version, w, args.warmup, args.repeat), workers("test"), ["compile"]))
+    if "coverage" in stages:
+        pipeline.append(("coverage", lambda version: get_version_coverage(path, *version, w), workers("coverage"), ["compile", "test"]))
+    if "complexity" in stages and args.complexity_engine == "local":
+        pipeline.append(("local_complexity", lambda version: get_version_local_complexity(path, *version, w, executor), workers("local_complexity"), ["checkout"]))
+    elif "complexity" in stages:
+        pipeline.append(("scan", lambda version: measure_version(scanner, path, *version, w, project_token), workers("scan"), ["compile", "test", "coverage"]))
+    return pipeline
+
+
+def evict_version(project, test, w, mode):
+    global budget
+    archive_path = w+"/archive/"+project+"/"+test+".tar.gz" if mode == "archive" else None
+    budget.evict(project, test, version_dir(w, project, test), archive_path)
+
+
+def exclusive_stages(stages, args):
+    # timed tests get the machine to themselves unless asked otherwise
+    if "test" not in stages or args.overlap_tests:
+        return []
+    if args.stage_workers.get("test", args.jobs) > 1:
+        logging.warning(f"timing tests with {args.stage_workers.get('test', args.jobs)} workers, versions will compete for the machine")
+    return ["test"]
+
+def is_finished(project, test, stages, args, inventories):
+    # every selected stage already has a result for the version
+    global store
+    cached = {
+        "checkout": ("checkout", "defects4j"),
+        "compile": ("compile", "defects4j"),
+        "coverage": ("coverage", "defects4j"),
+        "complexity": ("local_measures", "complexity-engine") if args.complexity_engine == "local" else ("sonar_measures", "sonar-scanner"),
+    }
+    for stage in stages:
+        if stage in cached and store.recorded(project, test, *cached[stage]) is None:
+            return False
+    if "test" in stages:
+        benchmark = store.recorded(project, test, "test_benchmark", "defects4j")
+        if benchmark is None or benchmark["warmup"] < args.warmup or benchmark["repeat"] < args.repeat:
+            return False
+    return True
+
+def stream_versions(path, scanner, versions, w, stages, args):
+    global budget
+    # with a budget, a version only enters the pipeline once its working tree
+    # fits, outside every stage so it never holds one up, and its tree goes as
+    # soon as its last stage is recorded
+    on_start = None if budget is None else lambda version: budget.acquire(*version)
+    if budget is not None:
+        # their trees were evicted, checking them out again would only redo cached work
+        inventories = {}
+        finished = {version for version in versions if is_finished(*version, stages, args, inventories)}
+        if finished:
+            logging.info(f"skipping {len(finished)} versions with every selected stage cached")
+            versions = [version for version in versions if version not in finished]
+    on_done = None if budget is None else lambda version: evict_version(*version, w, args.evict)
+    with process_pool(args.jobs) as executor:
+        ordered, predicted = schedule("test", versions, w, args.jobs)
+        start = time.monotonic()
+        results = run_pipeline(stage_pipeline(path, scanner, w, stages, args, executor), ordered, args.queue_size, on_done, exclusive_stages(stages, args), on_start)
+    if "complexity" in stages and args.complexity_engine == "sonar":
+        fetch_scanned_measures(versions, w)
+    # the prediction is for the test stage alone, which the rest streams around
+    tests = tracing.phase("test")
+    if predicted is not None and tests is not None:
+        logging.info(f"Getting testing delays for {describe(versions)}: predicted makespan {predicted:.0f}s, actual {tests:.0f}s")
+    logging.info(f"Pipeline over {describe(versions)} took {time.monotonic() - start:.0f}s")
+    return results
+
+
+def publish_versions(jobs, path, scanner, versions, w, stages, args):
+    # only the stage names and dependencies are needed to describe the jobs
+    names = [(name, after) for name, func, workers, after in stage_pipeline(path, scanner, w, stages, args, None)]
+    present = {name for name, after in names}
+    ordered, predicted = schedule("test", versions, w, args.jobs)
+    jobs.publish([(project, test, name, [dep for dep in after if dep in present]) for project, test in ordered for name, after in names])
+    logging.info(f"published {len(ordered) * len(names)} jobs for {describe(versions)}")
+
+
+def serve_versions(jobs, path, scanner, w, stages, args):
+    with process_pool(args.jobs) as executor:
+        functions = {name: func for name, func, workers, after in stage_pipeline(path, scanner, w, stages, args, executor)}
+        run_worker(jobs, functions, threads=args.jobs, exclusive=exclusive_stages(stages, args))
+
+
+def get_version_coverage(path, project, test, w):
+    global failures
+    global store
+    try:
+        cwd = version_dir(w, project, test)
+        cached = store.lookup(project, test, "coverage", "defects4j", cwd)
+        if cached is not None:
+            return cached
+        # each version writes coverage.xml into its own checkout, so a stale
+        # report from an earlier run is the only thing that could be misread
+        report = os.path.join(cwd, "coverage.xml")
+        if os.path.exists(report):
+            os.remove(report)
+        result = execute_command(path, DEFECTS4J_COVERAGE.split(), cwd=cwd, log=log_path(w, project, test, "coverage"), matchers=COVERAGE_MATCHERS)
+        if result.timed_out:
+            record_timeout(project, test, "coverage", result)
+            return None
+        store.record_duration(project, test, "coverage", result.wall_time)
+
+        if os.path.exists(report):
+            coverage = summarize_packages(store.record_coverage(project, test, iter_coverage(report)))
+        elif len(result.matches) == len(COVERAGE_MATCHERS):
+            coverage = {name: float(value) for name, value in result.matches.items()}
+        else:
+            logging.error(f"Failed to capture coverage for {test}, see {result.log_path}")
+            failures.append((project, test))
+            return None
+        store.record(project, test, "coverage", "defects4j", coverage, cwd)
+        return coverage
+    except Exception as e:
+        failures.append((project, test))
+        return None
+
+def get_coverage(path, versions, w, jobs=1):
+    ordered, predicted = schedule("coverage", versions, w, jobs)
+    results = run_versions(lambda version: get_version_coverage(path, *version, w), ordered, f"Calculating coverages for {describe(versions)}", jobs, predicted, stage="coverage")
+    coverages = {version: coverage for version, coverage in results.items() if coverage is not None}
     logging.info(coverages)
     return coverages
 
-def compile_all_versions(path, project, trigger_tests, w):
+def compile_version(path, project, test, w):
+    global store
+    cwd = version_dir(w, project, test)
+    if store.lookup(project, test, "compile", "defects4j", cwd) and has_classes(path, project, test, w):
+        return True
+    result = execute_command(path, DEFECTS4J_COMPILE.split(), cwd=cwd, log=log_path(w, project, test, "compile"))
+    if result.ok:
+        store.record(project, test, "compile", "defects4j", True, cwd)
+        store.record_duration(project, test, "compile", result.wall_time)
+    elif result.timed_out:
+        record_timeout(project, test, "compile", result)
+    else:
+        logging.error(f"compilation of {test} failed, see {result.log_path}")
+    return result.ok
 
-    for test in tqdm(trigger_tests, desc=f"Compiling versions for {project}", ncols=100):
-        cwd = w+"/345/"+test
-        status, output = execute_command(path, DEFECTS4J_COMPILE.split(), cwd=cwd)
+def compile_all_versions(path, versions, w, jobs=1):
+    ordered, predicted = schedule("compile", versions, w, jobs)
+    run_versions(lambda version: compile_version(path, *version, w), ordered, f"Compiling versions for {describe(versions)}", jobs, predicted, stage="compile")
     logging.info("Completed compilation of all versions")
 
-def get_testing_time(path, project, trigger_tests, w):
+def get_version_testing_time(path, project, test, w, warmup=0, repeat=1):
     global failures
-    logging.info(f"Getting testing times for project {project}")
-    delays = {}
-    for test in tqdm(trigger_tests, desc=f"Getting testing delays for {project}", ncols=100):
-        try:
-            cwd = w+"/345/"+test
-            start_time = datetime.now()
-            status, output = execute_command(path, DEFECTS4J_TEST.split(), cwd=cwd)
-            end_time = datetime.now()
-            delay = end_time - start_time
-            delays[test] = delay
-        except Exception as e:
-            failures.append(test)
+    global store
+    try:
+        cwd = version_dir(w, project, test)
+        cached = store.lookup(project, test, "test_benchmark", "defects4j", cwd)
+        if cached is not None and cached["warmup"] >= warmup and cached["repeat"] >= repeat:
+            return cached
+        start = time.monotonic()
+
+        # warm-up runs absorb compilation and cold file caches and are discarded
+        for run in range(warmup):
+            result = execute_command(path, DEFECTS4J_TEST.split(), cwd=cwd, log=log_path(w, project, test, f"test-warmup-{run}"))
+            if result.timed_out:
+                record_timeout(project, test, "test", result)
+                return None
+            if not result.ok:
+                logging.error(f"tests of {test} did not run, see {result.log_path}")
+                failures.append((project, test))
+                return None
+
+        samples = []
+        for run in range(repeat):
+            result = execute_command(path, DEFECTS4J_TEST.split(), cwd=cwd, log=log_path(w, project, test, "test" if repeat == 1 else f"test-{run}"))
+            if result.timed_out:
+                record_timeout(project, test, "test", result)
+                return None
+            if not result.ok:
+                logging.error(f"tests of {test} did not run, see {result.log_path}")
+                failures.append((project, test))
+                return None
+            samples.append({"wall_time": result.wall_time, "cpu_time": result.cpu_time, "max_rss_kb": result.max_rss_kb})
+        store.record_tests(project, test, collect_test_cases(cwd, result.log_path))
+
+        benchmark = summarize_samples(samples)
+        benchmark["warmup"] = warmup
+        benchmark["repeat"] = repeat
+        store.record(project, test, "test_benchmark", "defects4j", benchmark, cwd)
+        store.record(project, test, "test_time", "defects4j", benchmark["wall_time"]["median"], cwd)
+        store.record_duration(project, test, "test", time.monotonic() - start)
+        return benchmark
+    except Exception as e:
+        failures.append((project, test))
+        return None
+
+def get_testing_time(path, versions, w, jobs=1, warmup=0, repeat=1):
+    logging.info(f"Getting testing times for project {describe(versions)}")
+    if jobs > 1:
+        logging.warning(f"timing tests with {jobs} jobs, versions will compete for the machine")
+    ordered, predicted = schedule("test", versions, w, jobs)
+    results = run_versions(lambda version: get_version_testing_time(path, *version, w, warmup, repeat), ordered, f"Getting testing delays for {describe(versions)}", jobs, predicted, stage="test")
+    benchmarks = {version: benchmark for version, benchmark in results.items() if benchmark is not None}
+    delays = {version: timedelta(seconds=benchmark["wall_time"]["median"]) for version, benchmark in benchmarks.items()}
 
     logging.info("Completed delay calculation")
     logging.info(delays)
-    return delays
-
-def save_complexities_graph(project, complexities):
-
-    versions = sorted(complexities.keys(), key=lambda x: int(x))
-    x = [int(v) for v in versions]
-    y = [int(complexities[v]) for v in versions]
-
-    plt.figure(figsize=(10, 6))
-    plt.plot(x, y, marker='o', linestyle='-', color='blue')
-    plt.title(f'Cyclomatic Complexity Over {project} Project Versions')
-    plt.xlabel('Version')
-    plt.ylabel('Cyclomatic Complexity')
-    plt.grid(True)
-    plt.xticks(x)
-    plt.tight_layout()
-
-    plt.savefig(f"{project}_cyclomatic_complexity.png")
-    logging.info(f"Graph saved as '{project}_cyclomatic_complexity.png'")
-
-def save_test_delays_graph(project, delays):
-    delays_in_seconds = {k: v.total_seconds() if isinstance(v, timedelta) else v for k, v in delays.items()}
-
-    sorted_versions = sorted(delays_in_seconds.items(), key=lambda x: int(x[0]))
-    versions = [v[0] for v in sorted_versions]
-    delay_values = [v[1] for v in sorted_versions]
-
-    plt.figure(figsize=(10, 6))
-    plt.plot(versions, delay_values, marker='o', linestyle='-', color='purple')
-    plt.title('Delays Between Project Versions')
-    plt.xlabel('Version')
-    plt.ylabel('Delay (seconds)')
-    plt.grid(True)
-    plt.tight_layout()
-
-    plt.savefig(f"{project}_test_delays.png")
-    logging.info(f"Graph saved as '{project}_test_delays.png'")
-
-def save_coverage_graph(project, coverages):
-    sorted_items = sorted(coverages.items(), key=lambda x: x[0])
-    tests = [key for key, _ in sorted_items]
-    line_coverage = [val["line_coverage"] for _, val in sorted_items]
-    cond_coverage = [val["condition_coverage"] for _, val in sorted_items]
-
-    plt.figure(figsize=(10, 6))
-    plt.plot(tests, line_coverage, marker='o', label='Line Coverage', color='blue')
-    plt.plot(tests, cond_coverage, marker='s', label='Condition Coverage', color='orange')
-
-    plt.title('Test Coverage Over Time')
-    plt.xlabel('Test')
-    plt.ylabel('Coverage (%)')
-    plt.ylim(0, 100)
-    plt.grid(True)
-    plt.legend()
-    plt.tight_layout()
-
-    plt.savefig(f"{project}_coverage.png")
-    logging.info(f"Coverage graph saved as '{project}_coverage.png'")
-
-def remove_failed_tests(coverages, complexities, delays):
-    global failures
-    for failure in failures:
-        try:
-            coverages.pop(failure,"")
-            complexities.pop(failure, "")
-            delays.pop(failure,"")
-        except Exception as e: 
-            continue
-    return coverages, complexities, delays
+    return delays, benchmarks
+
+def run_stage_barriers(path, scanner, projects, w, stages, jobs, warmup=0, repeat=1, complexity_engine="sonar", share=True):
+    # versions of every selected project share one queue per stage, so the
+    # small projects fill the pool while the large ones finish
+    if "checkout" in stages:
+        bugs = [(project, test) for project in projects for test in get_project_bugs(path, project)]
+        checkout_all_versions(path, bugs, w, jobs, share)
+        logging.info("Done checking out all versions")
+    versions = [(project, test) for project in projects for test in get_tests(w, project)]
+    logging.info("Updated test files")
+    logging.info(versions)
 
+    if "coverage" in stages:
+        get_coverage(path, versions, w, jobs)
 
+    if "compile" in stages:
+        compile_all_versions(path, versions, w, jobs)
+    
+    if "complexity" in stages and complexity_engine == "local":
+        get_local_complexity(path, versions, w, jobs)
+    elif "complexity" in stages:
+        get_cyclomatic_complexity(scanner, path, versions,  w, project_token, jobs)
+
+    if "test" in stages:
+        get_testing_time(path, versions, w, jobs, warmup, repeat)
 
 def main():
     global user_token
     global project_token
+    global sonar_client
+    global store
     global failures
+    global admission
+    global budget
+    global scratch
+    global timeouts
+    global idle_timeouts
     args = arguments()
-    project = args.p
+    projects = AVAILABLE_PROJECTS if args.p == "all" else args.p.split(",")
     path = args.d
     w = args.w
     user_token = args.t
     project_token = args.k
     scanner = args.s
-
-    if project not in AVAILABLE_PROJECTS:
-        logging.error(f"{project} is not a project we decided to work on")
-        logging.error(AVAILABLE_PROJECTS)
+    jobs = args.jobs
+    stages = args.only
+
+    for project in projects:
+        if project not in AVAILABLE_PROJECTS:
+            logging.error(f"{project} is not a project we decided to work on")
+            logging.error(AVAILABLE_PROJECTS)
+            return
+
+    if args.render_only:
+        store = ResultStore(args.cache or w+"/results.db", {})
+        # the rows the last run kept, without rerunning anything
+        timed_out = [(project, version) for project, version, stage, reason, seconds in store.timeouts()]
+        render_all(drop_failed(build_dataset(store, projects, store.failures(projects), timed_out)), store, projects, args.slowest, jobs)
         return
 
-    trigger_tests = get_project_bugs(path, project)
+    if args.disk_budget or args.max_live:
+        budget = WorkspaceBudget(args.disk_budget * 2**30 if args.disk_budget else None, args.max_live)
+    scratch = args.tmpfs
+    if args.adaptive:
+        admission = AdmissionController(budgets=args.memory_budget)
+    sonar_client = SonarQubeClient(user_token, url=args.sonar_url, timeout=args.http_timeout, retries=args.http_retries, concurrency=args.http_concurrency)
 
+    idle_timeouts = args.idle_timeout
+    # the defaults until the results database has the durations of earlier runs
+    timeouts = stage_timeouts(lambda stage: {}, args.timeout)
     if not test_defects4j_path(path):
         logging.error("invalid defects4j bin path")
         return
-    
-    #checkout_all_versions(path, project, trigger_tests, w)
-    logging.info("Done checking out all versions")
-    trigger_tests = get_tests(w)
-    logging.info("Updated test files")
-    logging.info(trigger_tests)
 
+    tools = {"defects4j": tool_fingerprint(path+"/defects4j"), "sonar-scanner": tool_fingerprint(scanner+"/sonar-scanner"), "complexity-engine": engine_fingerprint()}
+    store = ResultStore(args.cache or w+"/results.db", tools, force=args.force, shared=args.role != "local")
+    timeouts = stage_timeouts(store.durations, args.timeout)
+    logging.info(f"command timeouts: {', '.join(f'{stage} {seconds:.0f}s' for stage, seconds in timeouts.items())}")
     
-    #coverages = get_coverage(path, project, trigger_tests, w)
-    coverages = []
-
-    #compile_all_versions(path, project, trigger_tests, w)
-    
-    complexities = get_cyclomatic_complexity(scanner, project, trigger_tests,  w, project_token)
+    if args.role != "local":
+        # -w, --cache and --queue must point at storage every host shares
+        job_queue = JobQueue(args.queue or w+"/jobs.db", lease=args.lease)
+        if args.role == "worker":
+            serve_versions(job_queue, path, scanner, w, stages, args)
+            # one trace per worker, the coordinator never sees their spans
+            name = worker_name().replace(":", "-")
+            stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+            tracing.save_trace(w+"/traces/trace-"+name+"-"+stamp+".json")
+            logging.info(f"Trace saved as '{w}/traces/trace-{name}-{stamp}.json'")
+            for line in tracing.report():
+                logging.info(line)
+            return
+        if "checkout" in stages:
+            versions = [(project, test) for project in projects for test in get_project_bugs(path, project)]
+        else:
+            versions = [(project, test) for project in projects for test in get_tests(w, project)]
+        publish_versions(job_queue, path, scanner, versions, w, stages, args)
+        wait_for_jobs(job_queue)
+        if "complexity" in stages and args.complexity_engine == "sonar":
+            fetch_scanned_measures(versions, w)
+        # a killed command also fails its job, but it is reported as a timeout below
+        killed = {(project, version) for project, version, stage, reason, seconds in store.timeouts()}
+        failures.extend(version for version in job_queue.failed() if version not in killed)
+    elif args.stage_barriers:
+        run_stage_barriers(path, scanner, projects, w, stages, jobs, args.warmup, args.repeat, args.complexity_engine, not args.private_objects)
+    else:
+        if "checkout" in stages:
+            versions = [(project, test) for project in projects for test in get_project_bugs(path, project)]
+        else:
+            versions = [(project, test) for project in projects for test in get_tests(w, project)]
+        stream_versions(path, scanner, versions, w, stages, args)
+
+    timed_out = store.timeouts()
+    store.record_failures(projects, failures)
+    dataset = build_dataset(store, projects, failures, [(project, version) for project, version, stage, reason, seconds in timed_out])
+    stamp = datetime.now().strftime("%Y%m%d-%H%M%S")
+    save_dataset(dataset, w+"/datasets/metrics-"+stamp+".csv")
+    logging.info(f"Metrics dataset saved as '{w}/datasets/metrics-{stamp}.csv'")
 
-    delays = get_testing_time(path, project, trigger_tests, w)
     logging.info(f"Ignoring gailed measures for tests: {failures}")
-    coverages, complexities, delays = remove_failed_tests(coverages, complexities, delays)
-    #save_coverage_graph(project, coverages)
-    save_complexities_graph(project, complexities)
-    save_test_delays_graph(project, delays)
+    if timed_out:
+        logging.warning(f"Ignoring timed out measures for tests: {[(project, version, stage, reason) for project, version, stage, reason, seconds in timed_out]}")
+    dataset = drop_failed(dataset)
+    correlation = correlations(dataset)
+    if correlation is not None:
+        save_correlations(correlation, w+"/datasets/correlations-"+stamp+".csv")
+        logging.info(f"Correlations over {correlation['rows']} versions of {CORRELATED}: {correlation['spearman'].round(2).tolist()}")
+
+    render_all(dataset, store, projects, args.slowest, jobs)
+
+    tracing.save_trace(w+"/traces/trace-"+stamp+".json")
+    logging.info(f"Trace saved as '{w}/traces/trace-{stamp}.json'")
+    for line in tracing.report():
+        logging.info(line)
 
 
 
-main()
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,152 @@
+import os
+import time
+import random
+import logging
+import threading
+import requests
+import tracing
+from requests.adapters import HTTPAdapter
+
+SONAR_URL = "http://localhost:9000"
+REPORT_TASK = os.path.join(".scannerwork", "report-task.txt")
+CE_PENDING = ("PENDING", "IN_PROGRESS")
+SONAR_METRICS = ["complexity", "cognitive_complexity", "ncloc", "functions", "duplicated_lines_density"]
+MEASURES_PAGE_SIZE = 100
+COMPONENT_TREE_PAGE_SIZE = 500
+RETRY_STATUSES = (429, 500, 502, 503, 504)
+
+
+class SonarQubeError(Exception):
+    pass
+
+
+class CeTaskError(SonarQubeError):
+    pass
+
+
+def project_key(project, version):
+    return f"{project}-{version}"
+
+
+def clear_report_task(cwd):
+    # a report left behind by an earlier scan would point us at an old task
+    try:
+        os.remove(os.path.join(cwd, REPORT_TASK))
+    except FileNotFoundError:
+        pass
+
+
+def read_report_task(cwd):
+    report = {}
+    with open(os.path.join(cwd, REPORT_TASK), "r", encoding="utf-8") as f:
+        for line in f:
+            key, sep, value = line.strip().partition("=")
+            if sep:
+                report[key] = value
+    return report
+
+
+class SonarQubeClient:
+    """Shared client for the SonarQube web API.
+
+    One pooled session is reused by every worker thread. Requests are capped
+    at `concurrency` in flight and retried with jittered exponential backoff
+    on connection errors, 429 and 5xx responses.
+    """
+
+    def __init__(self, token, url=SONAR_URL, timeout=30, retries=5, backoff=0.5, max_backoff=30, concurrency=4):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.retries = retries
+        self.backoff = backoff
+        self.max_backoff = max_backoff
+        self.slots = threading.BoundedSemaphore(concurrency)
+
+        self.session = requests.Session()
+        self.session.headers.update({'Authorization': f"Bearer {token}"})
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=concurrency)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def close(self):
+        self.session.close()
+
+    def retry_delay(self, attempt, response=None):
+        if response is not None and response.headers.get("Retry-After", "").isdigit():
+            return min(int(response.headers["Retry-After"]), self.max_backoff)
+        # full jitter keeps concurrent workers from retrying in lockstep
+        return random.uniform(0, min(self.max_backoff, self.backoff * 2 ** attempt))
+
+    def get(self, endpoint, params=None):
+        for attempt in range(self.retries + 1):
+            response = None
+            try:
+                with self.slots, tracing.span("http", endpoint=endpoint):
+                    response = self.session.get(f"{self.url}/{endpoint}", params=params, timeout=self.timeout)
+            except (requests.ConnectionError, requests.Timeout) as e:
+                error = f"{endpoint} request failed: {e}"
+            else:
+                if response.status_code == 200:
+                    return response.json()
+                error = f"{endpoint} request failed with status code {response.status_code}"
+                if response.status_code not in RETRY_STATUSES:
+                    raise SonarQubeError(error)
+
+            if attempt == self.retries:
+                break
+            delay = self.retry_delay(attempt, response)
+            logging.warning(f"{error}, retrying in {delay:.1f}s")
+            time.sleep(delay)
+
+        raise SonarQubeError(error)
+
+    def wait_for_task(self, task_id, timeout=600, initial_delay=0.2, max_delay=5):
+        deadline = time.monotonic() + timeout
+        delay = initial_delay
+
+        while True:
+            task = self.get("api/ce/task", {"id": task_id})["task"]
+            status = task["status"]
+            if status == "SUCCESS":
+                logging.debug(f"ce task {task_id} finished in {task.get('executionTimeMs')}ms")
+                return task
+            if status not in CE_PENDING:
+                raise CeTaskError(f"ce task {task_id} ended with status {status}")
+            if time.monotonic() + delay > deadline:
+                raise CeTaskError(f"ce task {task_id} still {status} after {timeout}s")
+
+            time.sleep(delay)
+            delay = min(delay * 2, max_delay)
+
+    def wait_for_analysis(self, cwd, timeout=600):
+        report = read_report_task(cwd)
+        with tracing.span("ce_wait", task=report["ceTaskId"]):
+            return self.wait_for_task(report["ceTaskId"], timeout)
+
+    def fetch_measures(self, keys, metrics=SONAR_METRICS):
+        measures = {key: {} for key in keys}
+
+        # api/measures/search accepts at most 100 project keys per call
+        for start in range(0, len(keys), MEASURES_PAGE_SIZE):
+            page = keys[start:start+MEASURES_PAGE_SIZE]
+            data = self.get("api/measures/search", {"projectKeys": ",".join(page), "metricKeys": ",".join(metrics)})
+            for measure in data["measures"]:
+                measures[measure["component"]][measure["metric"]] = measure["value"]
+
+        return measures
+
+    def fetch_file_measures(self, key, metrics=("complexity", "functions")):
+        # api/measures/component_tree pages through the files of one project
+        files = {}
+        page = 1
+        while True:
+            data = self.get("api/measures/component_tree", {
+                "component": key, "qualifiers": "FIL", "metricKeys": ",".join(metrics),
+                "ps": COMPONENT_TREE_PAGE_SIZE, "p": page,
+            })
+            for component in data["components"]:
+                files[component["path"]] = {measure["metric"]: measure["value"] for measure in component["measures"]}
+            paging = data["paging"]
+            if paging["pageIndex"] * paging["pageSize"] >= paging["total"]:
+                return files
+            page += 1
@@ -0,0 +1,65 @@
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+
+ALL_TESTS = "all_tests"
+TEST_ENTRY = re.compile(rb"^\s*([^\s(]+)\(([^)]+)\)\s*$", re.M)
+
+
+def read_all_tests(path):
+    with open(path, "rb") as f:
+        data = f.read()
+    # count lines on the raw bytes, the way `wc -l` does plus an unterminated last line
+    count = data.count(b"\n") + (1 if data and not data.endswith(b"\n") else 0)
+    entries = [(test_class.decode(), method.decode()) for method, test_class in TEST_ENTRY.findall(data)]
+    return count, entries
+
+
+def scan_inventory(base_path):
+    files = {}
+    with os.scandir(base_path) as entries:
+        for entry in entries:
+            if not entry.is_dir():
+                continue
+            try:
+                stat = os.stat(os.path.join(entry.path, ALL_TESTS))
+            except FileNotFoundError:
+                continue
+            files[entry.name] = (os.path.join(entry.path, ALL_TESTS), stat.st_mtime_ns, stat.st_size)
+    return files
+
+
+def index_version(store, project, version, cwd):
+    # for a checkout about to be evicted, so its count outlives the working tree
+    path = os.path.join(cwd, ALL_TESTS)
+    try:
+        stat = os.stat(path)
+    except FileNotFoundError:
+        return None
+    count, entries = read_all_tests(path)
+    store.record_test_inventory(project, version, stat.st_mtime_ns, stat.st_size, count, entries)
+    return count
+
+
+def index_tests(store, project, base_path, jobs=1):
+    """Number of tests per version from each checkout's all_tests file.
+
+    Files whose mtime and size match the stored index are not read again;
+    the rest are parsed in parallel into class/method rows.
+    """
+    if not os.path.isdir(base_path):
+        return {}
+    files = scan_inventory(base_path)
+    cached = store.test_inventory(project)
+    stale = [version for version, (path, mtime, size) in files.items() if cached.get(version, (None, None, None))[:2] != (mtime, size)]
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        parsed = dict(zip(stale, executor.map(lambda version: read_all_tests(files[version][0]), stale)))
+
+    for version, (count, entries) in parsed.items():
+        path, mtime, size = files[version]
+        store.record_test_inventory(project, version, mtime, size, count, entries)
+
+    counts = {version: cached[version][2] for version in files if version in cached and version not in parsed}
+    counts.update({version: count for version, (count, entries) in parsed.items()})
+    return counts
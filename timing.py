@@ -0,0 +1,47 @@
+import math
+import statistics
+
+Z_95 = 1.96
+
+
+def quantile(values, q):
+    values = sorted(values)
+    position = (len(values) - 1) * q
+    low = math.floor(position)
+    high = math.ceil(position)
+    return values[low] + (values[high] - values[low]) * (position - low)
+
+
+def summarize(values, z=Z_95):
+    values = sorted(values)
+    n = len(values)
+    median = statistics.median(values)
+    q1 = quantile(values, 0.25)
+    q3 = quantile(values, 0.75)
+
+    # distribution-free confidence interval for the median taken from the
+    # order statistics, so a single slow outlier cannot drag it around
+    half_width = z * math.sqrt(n) / 2
+    low = max(0, math.floor(n / 2 - half_width) - 1)
+    high = min(n - 1, math.ceil(1 + n / 2 + half_width) - 1)
+
+    return {
+        "n": n,
+        "median": median,
+        "q1": q1,
+        "q3": q3,
+        "iqr": q3 - q1,
+        "ci_low": values[low],
+        "ci_high": values[high],
+        "min": values[0],
+        "max": values[-1],
+    }
+
+
+def summarize_samples(samples):
+    return {
+        "wall_time": summarize([sample["wall_time"] for sample in samples]),
+        "cpu_time": summarize([sample["cpu_time"] for sample in samples]),
+        "max_rss_kb": max(sample["max_rss_kb"] for sample in samples),
+        "samples": samples,
+    }
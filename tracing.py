@@ -0,0 +1,189 @@
+import os
+import json
+import time
+import threading
+import resource
+from contextlib import contextmanager
+
+ORIGIN = time.monotonic()
+spans = []
+lock = threading.Lock()
+local = threading.local()
+threads = {}
+
+
+def thread_id():
+    with lock:
+        return threads.setdefault(threading.get_ident(), len(threads) + 1)
+
+
+def stack():
+    if not hasattr(local, "stack"):
+        local.stack = []
+    return local.stack
+
+
+@contextmanager
+def span(name, project=None, version=None, **args):
+    """Record a span for the enclosed work on this thread.
+
+    cpu_time is the thread's own CPU; child_cpu and max_rss_kb come from the
+    commands run inside it (see add_child) and roll up into the parent span.
+    """
+    current = {
+        "name": name,
+        "project": project,
+        "version": version,
+        "parent": stack()[-1]["name"] if stack() else None,
+        "tid": thread_id(),
+        "start": time.monotonic(),
+        "cpu_start": time.thread_time(),
+        "child_cpu": 0.0,
+        "max_rss_kb": 0,
+        "args": args,
+    }
+    stack().append(current)
+    try:
+        yield current
+    finally:
+        stack().pop()
+        current["wall"] = time.monotonic() - current["start"]
+        current["cpu_time"] = time.thread_time() - current.pop("cpu_start")
+        if stack():
+            stack()[-1]["child_cpu"] += current["child_cpu"]
+            stack()[-1]["max_rss_kb"] = max(stack()[-1]["max_rss_kb"], current["max_rss_kb"])
+        with lock:
+            spans.append(current)
+
+
+def add_child(cpu_time, max_rss_kb):
+    # called by run_command for every reaped child
+    if stack():
+        stack()[-1]["child_cpu"] += cpu_time
+        stack()[-1]["max_rss_kb"] = max(stack()[-1]["max_rss_kb"], max_rss_kb)
+
+
+def record(name, start, wall, cpu_time=0.0, project=None, version=None, **args):
+    """Add a span measured elsewhere, e.g. in a worker process, with start on the monotonic clock."""
+    with lock:
+        spans.append({
+            "name": name, "project": project, "version": version, "parent": None, "tid": 0,
+            "start": start, "wall": wall, "cpu_time": 0.0, "child_cpu": cpu_time, "max_rss_kb": 0, "args": args,
+        })
+
+
+def timed(func, *args):
+    # runs in a worker process; the monotonic clock is shared by the whole machine
+    start = time.monotonic()
+    before = resource.getrusage(resource.RUSAGE_SELF)
+    func(*args)
+    after = resource.getrusage(resource.RUSAGE_SELF)
+    cpu = after.ru_utime - before.ru_utime + after.ru_stime - before.ru_stime
+    return start, time.monotonic() - start, cpu
+
+
+def save_trace(path):
+    """Write every span as Chrome trace-event JSON (chrome://tracing, Perfetto)."""
+    os.makedirs(os.path.dirname(path) or ".", exist_ok=True)
+    with lock:
+        finished = list(spans)
+    events = [{"name": "thread_name", "ph": "M", "pid": 1, "tid": 0, "args": {"name": "render processes"}}]
+    for tid in sorted({item["tid"] for item in finished} - {0}):
+        events.append({"name": "thread_name", "ph": "M", "pid": 1, "tid": tid, "args": {"name": f"worker {tid}"}})
+    for item in finished:
+        label = f"{item['project']}-{item['version']}" if item["version"] is not None else item["project"]
+        events.append({
+            "name": item["name"] if label is None else f"{item['name']} {label}",
+            "cat": item["name"],
+            "ph": "X",
+            "pid": 1,
+            "tid": item["tid"],
+            "ts": round((item["start"] - ORIGIN) * 1e6),
+            "dur": round(item["wall"] * 1e6),
+            "args": dict(item["args"], project=item["project"], version=item["version"], cpu_time=round(item["cpu_time"], 3), child_cpu=round(item["child_cpu"], 3), max_rss_kb=item["max_rss_kb"]),
+        })
+    with open(path, "w") as f:
+        json.dump({"traceEvents": events, "displayTimeUnit": "ms"}, f)
+
+
+def breakdown(key):
+    totals = {}
+    with lock:
+        finished = list(spans)
+    for item in finished:
+        row = totals.setdefault(key(item), {"count": 0, "wall": 0.0, "cpu": 0.0, "max_rss_kb": 0})
+        row["count"] += 1
+        row["wall"] += item["wall"]
+        row["cpu"] += item["cpu_time"] + item["child_cpu"]
+        row["max_rss_kb"] = max(row["max_rss_kb"], item["max_rss_kb"])
+    return totals
+
+
+def top_level():
+    with lock:
+        return [item for item in spans if item["parent"] is None]
+
+
+def finish(item):
+    return item["start"] + item["wall"]
+
+
+def phase(name):
+    """Seconds from the first top-level span of a stage starting to the last one ending."""
+    items = [item for item in top_level() if item["name"] == name]
+    if not items:
+        return None
+    return max(finish(item) for item in items) - min(item["start"] for item in items)
+
+
+def critical_path():
+    """The chain of top-level spans that ended the run.
+
+    Stages overlap across versions, so the run is bounded by the version
+    that finished last: its stages in order, each with the time it waited
+    after the previous one (queued behind other versions), followed by what
+    ran once every version was done, such as rendering.
+    """
+    top = top_level()
+    versioned = [item for item in top if item["version"] is not None]
+    if not versioned:
+        return []
+    begin = min(item["start"] for item in top)
+    last = max(versioned, key=finish)
+    chain = sorted([item for item in versioned if (item["project"], item["version"]) == (last["project"], last["version"])], key=lambda item: item["start"])
+    # of the stages that ran once per project or run, the span of each that finished last
+    after = {}
+    for item in top:
+        if item["version"] is None and item["start"] >= finish(last) and finish(item) >= finish(after.get(item["name"], item)):
+            after[item["name"]] = item
+    chain += sorted(after.values(), key=lambda item: item["start"])
+    path = []
+    previous = begin
+    for item in chain:
+        path.append({
+            "stage": item["name"],
+            "project": item["project"],
+            "version": item["version"],
+            "span": item["wall"],
+            "queued": max(0.0, item["start"] - previous),
+            "end": finish(item) - begin,
+        })
+        previous = max(previous, finish(item))
+    return path
+
+
+def report():
+    """Log lines answering where the run's time went."""
+    lines = ["stage breakdown (wall s, cpu s incl. children, max child rss MB, spans):"]
+    for name, row in sorted(breakdown(lambda item: item["name"]).items(), key=lambda row: -row[1]["wall"]):
+        lines.append(f"  {name:<16} {row['wall']:10.1f} {row['cpu']:10.1f} {row['max_rss_kb'] / 1024:8.0f} {row['count']:6d}")
+    lines.append("per project (wall s of top-level stages):")
+    per_project = breakdown(lambda item: (item["project"], item["name"]) if item["parent"] is None and item["project"] else None)
+    per_project.pop(None, None)
+    for (project, name), row in sorted(per_project.items()):
+        lines.append(f"  {project:<10} {name:<16} {row['wall']:10.1f}")
+    lines.append("critical path:")
+    for step in critical_path():
+        label = f"{step['project']}-{step['version']}" if step["version"] is not None else "-"
+        lines.append(f"  {step['stage']:<16} {label:<12} {step['span']:8.1f}s ending at {step['end']:8.1f}s, queued {step['queued']:.1f}s")
+    return lines
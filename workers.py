@@ -0,0 +1,186 @@
+import time
+import queue
+import logging
+import threading
+import multiprocessing
+from contextlib import contextmanager
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, as_completed
+from tqdm import tqdm
+import tracing
+
+
+def run_versions(func, versions, desc, jobs=1, predicted=None, stage=None):
+    # every stage shells out to defects4j/sonar-scanner, so threads are enough
+    # to keep the cores busy while the main process only waits on children.
+    # The pool starts jobs in submission order, so callers pass versions
+    # already in the order they should be dispatched.
+    results = {}
+    start = time.monotonic()
+    if stage is not None:
+        # one span per version, named after the stage, around the whole call
+        untraced = func
+        def func(version):
+            with tracing.span(stage, *version):
+                return untraced(version)
+
+    with ThreadPoolExecutor(max_workers=max(1, jobs)) as executor:
+        futures = {executor.submit(func, version): version for version in versions}
+        for future in tqdm(as_completed(futures), total=len(futures), desc=desc, ncols=100):
+            results[futures[future]] = future.result()
+    if predicted is not None:
+        logging.info(f"{desc}: predicted makespan {predicted:.0f}s, actual {time.monotonic() - start:.0f}s")
+    return results
+
+
+def process_pool(workers):
+    # forked workers started from a pipeline thread would inherit the pipes of
+    # another thread's half-started Popen and keep it from ever returning
+    return ProcessPoolExecutor(max_workers=max(1, workers), mp_context=multiprocessing.get_context("forkserver"))
+
+
+def describe(versions):
+    return ",".join(sorted({project for project, test in versions}))
+
+
+class StageGate:
+    """Keeps the exclusive stages from running while any other stage does.
+
+    Exclusive stages may still overlap each other, and a waiting one holds
+    back every other stage until it gets in, so it is never starved.
+    """
+
+    def __init__(self, exclusive=()):
+        self.exclusive = set(exclusive)
+        self.running = 0
+        self.exclusive_running = 0
+        self.exclusive_waiting = 0
+        self.condition = threading.Condition()
+
+    @contextmanager
+    def enter(self, name):
+        if not self.exclusive:
+            yield
+            return
+        alone = name in self.exclusive
+        with self.condition:
+            if alone:
+                self.exclusive_waiting += 1
+                while self.running:
+                    self.condition.wait()
+                self.exclusive_waiting -= 1
+                self.exclusive_running += 1
+            else:
+                while self.exclusive_running or self.exclusive_waiting:
+                    self.condition.wait()
+                self.running += 1
+        try:
+            yield
+        finally:
+            with self.condition:
+                if alone:
+                    self.exclusive_running -= 1
+                else:
+                    self.running -= 1
+                self.condition.notify_all()
+
+
+def run_pipeline(stages, versions, queue_size=None, on_done=None, exclusive=(), on_start=None):
+    """Stream versions through a DAG of stages instead of running each stage over every version.
+
+    stages is a list of (name, func, workers, after) in dependency order; a
+    version enters a stage once every stage named in after succeeded for it,
+    and is dropped from its dependents when func returns None or False.
+    Every stage has its own workers and a bounded queue, so a stage that
+    runs ahead blocks on its successor's queue instead of piling up work.
+    on_start(version) is called, and may block, before a version enters the
+    first stages; on_done(version) once every stage has finished or skipped it.
+    Stages named in exclusive only run while no other stage does.
+    Returns {stage: {version: result}}.
+    """
+    names = [name for name, func, workers, after in stages]
+    dependents = {name: [other for other, func, workers, after in stages if name in after] for name in names}
+    prerequisites = {name: [dep for dep in after if dep in names] for name, func, workers, after in stages}
+    queues = {name: queue.Queue(maxsize=queue_size or max(1, workers)) for name, func, workers, after in stages}
+    results = {name: {} for name in names}
+    waiting = {(version, name): len(prerequisites[name]) for version in versions for name in names}
+    left = {version: len(names) for version in versions}
+    unfinished = [len(versions)]
+    lock = threading.Lock()
+    done = threading.Event()
+    gate = StageGate(exclusive)
+    bars = {name: tqdm(total=len(versions), desc=name, position=index, ncols=100) for index, name in enumerate(names)}
+
+    def finish(version, name, result):
+        # returns the dependents that became ready, those of a failed stage are
+        # skipped, and whether the version has now been through every stage
+        ready = []
+        with lock:
+            pending = [(name, result)]
+            while pending:
+                stage, result = pending.pop()
+                if version in results[stage]:
+                    continue
+                results[stage][version] = result
+                bars[stage].update()
+                left[version] -= 1
+                for dependent in dependents[stage]:
+                    if result is None or result is False:
+                        pending.append((dependent, None))
+                        continue
+                    waiting[(version, dependent)] -= 1
+                    if waiting[(version, dependent)] == 0:
+                        ready.append(dependent)
+            return ready, left[version] == 0
+
+    def retire(version):
+        if on_done is not None:
+            try:
+                on_done(version)
+            except Exception as e:
+                logging.error(f"finishing {version} failed: {e}")
+        with lock:
+            unfinished[0] -= 1
+            if unfinished[0] == 0:
+                done.set()
+
+    def work(name, func):
+        while True:
+            version = queues[name].get()
+            if version is None:
+                return
+            with gate.enter(name), tracing.span(name, *version):
+                try:
+                    result = func(version)
+                except Exception as e:
+                    logging.error(f"{name} of {version} failed: {e}")
+                    result = None
+            ready, finished = finish(version, name, result)
+            for dependent in ready:
+                queues[dependent].put(version)
+            if finished:
+                retire(version)
+
+    threads = []
+    for name, func, workers, after in stages:
+        for worker in range(max(1, workers)):
+            thread = threading.Thread(target=work, args=(name, func), daemon=True)
+            thread.start()
+            threads.append((name, thread))
+
+    if not versions:
+        done.set()
+    for version in versions:
+        if on_start is not None:
+            on_start(version)
+        for name in names:
+            if not prerequisites[name]:
+                queues[name].put(version)
+    done.wait()
+
+    for name, thread in threads:
+        queues[name].put(None)
+    for name, thread in threads:
+        thread.join()
+    for bar in bars.values():
+        bar.close()
+    return {name: {version: result for version, result in stage.items() if result is not None and result is not False} for name, stage in results.items()}
@@ -0,0 +1,122 @@
+import os
+import shutil
+import tarfile
+import logging
+import threading
+
+
+def tree_size(cwd):
+    total = 0
+    for root, dirs, files in os.walk(cwd):
+        for name in files:
+            try:
+                total += os.lstat(os.path.join(root, name)).st_size
+            except OSError:
+                pass
+    return total
+
+
+def remove(cwd):
+    # cwd is a symlink when the working tree lives on tmpfs
+    if os.path.islink(cwd):
+        target = os.path.realpath(cwd)
+        os.unlink(cwd)
+        shutil.rmtree(target, ignore_errors=True)
+    elif os.path.isdir(cwd):
+        shutil.rmtree(cwd)
+
+
+def place(cwd, scratch, project, version):
+    """Directory defects4j should check out into: cwd itself, or a scratch directory cwd will link to."""
+    remove(cwd)
+    if scratch is None:
+        return cwd
+    target = os.path.join(scratch, project, version)
+    remove(target)
+    os.makedirs(os.path.dirname(target), exist_ok=True)
+    os.makedirs(os.path.dirname(cwd), exist_ok=True)
+    os.symlink(target, cwd)
+    return target
+
+
+def archive(cwd, path):
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    with tarfile.open(path + ".tmp", "w:gz") as tar:
+        tar.add(os.path.realpath(cwd), arcname=os.path.basename(cwd))
+    os.replace(path + ".tmp", path)
+
+
+class WorkspaceBudget:
+    """Bounds the working trees alive at once by count and by bytes.
+
+    A checkout reserves the largest tree seen so far for its project, or
+    for any project; until the first tree is measured only one is let in.
+    The reservation becomes the tree's real size once measure() is called
+    after the checkout, and is given back when the version is evicted, with
+    the size the build and test output grew it to. One tree is always
+    allowed so a run can never stall.
+    """
+
+    def __init__(self, max_bytes=None, max_live=None):
+        self.max_bytes = max_bytes
+        self.max_live = max_live
+        self.sizes = {}
+        self.live = {}
+        self.reserved = 0
+        self.condition = threading.Condition()
+
+    def estimate(self, project):
+        if project in self.sizes:
+            return self.sizes[project]
+        return max(self.sizes.values(), default=None)
+
+    def fits(self, need):
+        if not self.live:
+            return True
+        if self.max_live is not None and len(self.live) >= self.max_live:
+            return False
+        if self.max_bytes is None:
+            return True
+        return need is not None and self.reserved + need <= self.max_bytes
+
+    def acquire(self, project, version):
+        with self.condition:
+            if (project, version) in self.live:
+                return
+            # the estimate improves as other trees are measured while this one waits
+            while not self.fits(self.estimate(project)):
+                self.condition.wait()
+            need = self.estimate(project)
+            self.live[(project, version)] = need or 0
+            self.reserved += need or 0
+
+    def learn(self, project, size):
+        # a failed checkout leaves nothing to learn from
+        if size:
+            self.sizes[project] = max(self.sizes.get(project, 0), size)
+
+    def measure(self, project, version, size):
+        """Replace a live version's reservation with the size of its fresh checkout."""
+        with self.condition:
+            self.learn(project, size)
+            if (project, version) in self.live:
+                self.reserved += size - self.live[(project, version)]
+                self.live[(project, version)] = size
+            self.condition.notify_all()
+
+    def release(self, project, version, size):
+        with self.condition:
+            self.learn(project, size)
+            self.reserved -= self.live.pop((project, version), 0)
+            self.condition.notify_all()
+
+    def evict(self, project, version, cwd, archive_path=None):
+        """Archive or delete a finished version's working tree and free its place in the budget."""
+        size = tree_size(cwd)
+        try:
+            if archive_path is not None and os.path.exists(cwd):
+                archive(cwd, archive_path)
+            remove(cwd)
+            logging.debug(f"evicted {project} {version}, {size / 2**20:.0f} MB")
+        finally:
+            self.release(project, version, size)